@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 21:10
+# @Author : shl
+# @File : fakes.py
+# @Desc : 压测用redis/mongo客户端,统计redis命令数,可替换为进程内的fakeredis/mongomock
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import redis
+from redis.client import Pipeline
+
+from bench.site import PageHandler
+from spider.pipelines import SpiderMongoPipeline
+
+
+class CommandCounter:
+    """
+    redis命令计数,round_trips为网络往返次数(管道一次提交算一次)
+    """
+
+    def __init__(self):
+        self.commands = 0
+        self.round_trips = 0
+        self._lock = threading.Lock()
+
+    def add(self, commands, round_trips=1):
+        with self._lock:
+            self.commands += commands
+            self.round_trips += round_trips
+
+    def snapshot(self):
+        with self._lock:
+            return self.commands, self.round_trips
+
+
+COUNTER = CommandCounter()
+
+
+class CountingPipeline(Pipeline):
+
+    def execute(self, raise_on_error=True):
+        if self.command_stack:
+            COUNTER.add(len(self.command_stack))
+        return super(CountingPipeline, self).execute(raise_on_error)
+
+
+class CountingMixin:
+
+    def execute_command(self, *args, **options):
+        COUNTER.add(1)
+        return super(CountingMixin, self).execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return CountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class CountingRedis(CountingMixin, redis.StrictRedis):
+    """
+    本地redis,REDIS_PARAMS['redis_cls']
+    """
+
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+else:
+    FAKE_SERVER = fakeredis.FakeServer()
+
+    class FakeRedis(CountingMixin, fakeredis.FakeStrictRedis):
+        """
+        进程内redis(lua脚本需要安装lupa),同一进程内的所有客户端共用一份数据
+        """
+
+        def __init__(self, *args, **kwargs):
+            kwargs['server'] = FAKE_SERVER
+            super(FakeRedis, self).__init__(*args, **kwargs)
+
+        @classmethod
+        def from_url(cls, url, **kwargs):
+            return cls(**kwargs)
+
+
+class BenchMongoPipeline(SpiderMongoPipeline):
+    """
+    MONGO_URI为 mongomock:// 时使用进程内mongo
+    """
+
+    def open_spider(self, spider):
+        if self.mongo_uri.startswith('mongomock://'):
+            import mongomock
+            self.client_cls = lambda uri: mongomock.MongoClient()
+        super(BenchMongoPipeline, self).open_spider(spider)
+
+
+class ProxyFarm:
+    """
+    本地模拟代理: count个HTTP代理,直接返回压测站点的页面(不真正转发),
+    按ban_rate的概率返回403模拟代理被封禁,delay为每个请求额外的耗时(秒)
+    """
+
+    def __init__(self, site, count=10, ban_rate=0.0, delay=0.0, host='127.0.0.1'):
+        self.site = site
+        self.ban_rate = ban_rate
+        self.delay = delay
+        self.servers = []
+        for _ in range(count):
+            server = ThreadingHTTPServer((host, 0), self._handler())
+            server.daemon_threads = True
+            self.servers.append(server)
+        self.banned = 0
+        self._lock = threading.Lock()
+
+    @property
+    def addresses(self):
+        return ['{0}:{1}'.format(*server.server_address[:2]) for server in self.servers]
+
+    def start(self):
+        for server in self.servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def seed(self, server, key, count):
+        """
+        代理地址轮流写入代理队列
+        :param server: redis
+        :param key: PROXY_REDIS_KEY
+        :param count: 写入的代理数
+        :return:
+        """
+        addresses = self.addresses
+        server.rpush(key, *[addresses[i % len(addresses)] for i in range(count)])
+
+    def _handler(self):
+        farm = self
+
+        class Handler(PageHandler):
+            def do_GET(self):
+                if farm.delay:
+                    time.sleep(farm.delay)
+                if farm.ban_rate and random.random() < farm.ban_rate:
+                    with farm._lock:
+                        farm.banned += 1
+                    self.send_page('<html><body>banned</body></html>', status=403)
+                    return
+                self.send_page(farm.site.render(self.path))
+
+        return Handler
@@ -0,0 +1,307 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 21:10
+# @Author : shl
+# @File : run.py
+# @Desc : 离线压测: 本地站点 + 本地/进程内redis、mongo,依次运行主爬虫、子爬虫并输出吞吐与资源占用
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from scrapy import signals
+from scrapy.crawler import Crawler, CrawlerRunner
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.log import configure_logging
+from scrapy.utils.project import get_project_settings
+from scrapy_redis import connection
+from twisted.internet import defer, reactor
+
+from bench.fakes import COUNTER, ProxyFarm
+from bench.site import SyntheticSite
+from spider.spiders.main import Spider
+
+TEMPLATE_ID = 1
+TABLE = 'bench'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='主/子爬虫离线压测')
+    parser.add_argument('--sites', type=int, default=2, help='站点数')
+    parser.add_argument('--chains', type=int, default=5, help='每个站点的入口列表数')
+    parser.add_argument('--pages', type=int, default=5, help='每个入口列表的页数')
+    parser.add_argument('--fanout', type=int, default=50, help='每个列表页的详情链接数')
+    parser.add_argument('--size', type=int, default=20000, help='详情页大小(字节)')
+    parser.add_argument('--concurrency', type=int, default=32, help='CONCURRENT_REQUESTS')
+    parser.add_argument('--domains', type=int, default=1,
+                        help='站点分布的域名数,第n个域名监听127.0.0.n,站点按顺序轮流分配到各域名')
+    parser.add_argument('--slow-domains', type=int, default=0, help='慢域名数(前n个域名)')
+    parser.add_argument('--slow-delay', type=float, default=1.0, help='慢域名每个请求额外的耗时(秒)')
+    parser.add_argument('--proxies', type=int, default=0, help='本地模拟代理数,大于0时开启IS_PROXY')
+    parser.add_argument('--proxy-ban-rate', type=float, default=0.0, help='模拟代理返回403的概率')
+    parser.add_argument('--proxy-delay', type=float, default=0.0, help='模拟代理每个请求额外的耗时(秒)')
+    parser.add_argument('--fake', action='store_true', help='使用进程内fakeredis/mongomock,需安装 fakeredis lupa mongomock')
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15', help='本地redis,压测前清空该库')
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/', help='本地mongo,压测前删除 spider_bench 库')
+    parser.add_argument('--timeout', type=int, default=600, help='单个阶段的超时时间(秒)')
+    parser.add_argument('--output', default='bench_output.txt', help='结果追加写入的文件')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='覆盖爬虫配置,如 -s REDIS_JUDGE_STORE=fingerprint -s TASK_CODEC=json')
+    return parser.parse_args(argv)
+
+
+def script_package(sites):
+    """
+    生成压测站点的模板脚本包,每个站点一个 s站点id_模板id 模块
+    :param sites:
+    :return: (包名, 预加载列表)
+    """
+    directory = tempfile.mkdtemp(prefix='spider_bench_')
+    package = 'bench_script'
+    os.makedirs(os.path.join(directory, package))
+    open(os.path.join(directory, package, '__init__.py'), 'w').close()
+    names = []
+    for site_id in range(1, sites + 1):
+        name = '{0}_{1}'.format(site_id, TEMPLATE_ID)
+        with open(os.path.join(directory, package, 's{0}.py'.format(name)), 'w') as f:
+            f.write('from bench.template import Script  # noqa\n')
+        names.append(name)
+    sys.path.insert(0, directory)
+    return package, names
+
+
+def override_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def bench_settings(args, package, names):
+    settings = get_project_settings()
+    downloader_middlewares = settings.getdict('DOWNLOADER_MIDDLEWARES')
+    downloader_middlewares['spider.middlewares.SpiderUserAgentMiddleware'] = None  # 离线运行,不请求UA列表
+    extensions = settings.getdict('EXTENSIONS')
+    extensions['spider.extensions.SpiderStatueStatistics'] = None  # 不写influxdb,耗时分位数直接输出
+    settings.setdict({
+        'SCRIPT_PACKAGE': package,
+        'SCRIPT_PRELOAD': names,
+        'IS_PROXY': args.proxies > 0,
+        'DOWNLOADER_MIDDLEWARES': downloader_middlewares,
+        'EXTENSIONS': extensions,
+        'ITEM_PIPELINES': {
+            'spider.pipelines.SpiderRedisPipeline': 200,
+            'bench.fakes.BenchMongoPipeline': 300,
+        },
+        'CONCURRENT_REQUESTS': args.concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': args.concurrency,
+        'AUTOTHROTTLE_ENABLED': False,
+        'LOG_LEVEL': args.log_level,
+        'REDIS_URL': args.redis_url,
+        'REDIS_PARAMS': {'redis_cls': 'bench.fakes.FakeRedis' if args.fake else 'bench.fakes.CountingRedis'},
+        'MONGO_URI': 'mongomock://' if args.fake else args.mongo_uri,
+        'MONGO_DATABASE': 'spider_bench',
+        'CLOSESPIDER_TIMEOUT': args.timeout,
+    }, priority='cmdline')
+    for item in args.set:
+        name, _, value = item.partition('=')
+        settings.set(name, override_value(value), priority='cmdline')
+    return settings
+
+
+def reset(server, args):
+    """
+    清空压测用的redis库与mongo库
+    :param server:
+    :param args:
+    :return:
+    """
+    server.flushdb()
+    if not args.fake:
+        import pymongo
+        client = pymongo.MongoClient(args.mongo_uri)
+        client.drop_database('spider_bench')
+        client.close()
+
+
+def start_domains(args):
+    """
+    启动各域名的本地站点,前 slow_domains 个为慢站点
+    :return: list SyntheticSite
+    """
+    return [SyntheticSite(args.pages, args.fanout, args.size, host='127.0.0.{0}'.format(n + 1),
+                          delay=args.slow_delay if n < args.slow_domains else 0.0).start()
+            for n in range(args.domains)]
+
+
+def seed(server, settings, domains, args):
+    """
+    入口列表任务写入主爬虫队列
+    :return: 入口任务数
+    """
+    key = settings.get('REDIS_START_URLS_MASTER_KEY') % {'name': Spider.name}
+    tasks = []
+    for site_id in range(1, args.sites + 1):
+        site = domains[(site_id - 1) % len(domains)]
+        for chain in range(args.chains):
+            tasks.append(json.dumps({'site_id': site_id, 'template_id': TEMPLATE_ID, 'table': TABLE,
+                                     'task_type': 0, 'url': site.list_url(site_id, chain)}))
+    server.rpush(key, *tasks)
+    return len(tasks)
+
+
+def seed_proxies(server, settings, farm, args):
+    """
+    模拟代理写入代理队列,数量足够两个阶段使用(代理达到使用次数上限后退出,封禁的代理移出代理池)
+    :return: 写入的代理数
+    """
+    requests = args.sites * args.chains * args.pages * (1 + args.fanout)
+    batch_size = settings.getint('PROXY_BATCH_SIZE', 20)
+    count = (requests // settings.getint('PROXY_MAX_USES', 5) + 1) * 2
+    count = count * batch_size // min(len(farm.servers), batch_size)  # 同一批中重复的代理只使用一次
+    farm.seed(server, settings.get('PROXY_REDIS_KEY'), count)
+    return count
+
+
+def redis_memory(server):
+    try:
+        return int(server.info('memory')['used_memory'])
+    except Exception:
+        return None
+
+
+def max_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # linux下单位为KB
+
+
+class DomainCounter:
+    """
+    按域名统计响应数与最后一个响应的时间,多域名压测时观察快站点是否被慢站点拖住
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.pages = defaultdict(int)
+        self.last = {}
+
+    def response_received(self, response, request, spider):
+        host = urlparse_cached(request).hostname
+        self.pages[host] += 1
+        self.last[host] = time.time() - self.start
+
+
+class PhaseResult:
+    """
+    单个阶段的压测结果
+    """
+
+    def __init__(self, name, crawler, elapsed, commands, round_trips, redis_bytes, domains=None):
+        stats = crawler.stats.get_stats()
+        self.name = name
+        self.elapsed = elapsed
+        self.pages = stats.get('response_received_count', 0)
+        self.items = stats.get('item_scraped_count', 0)
+        self.finish_reason = stats.get('finish_reason')
+        self.commands = commands
+        self.round_trips = round_trips
+        self.redis_bytes = redis_bytes
+        self.rss = max_rss()
+        self.domains = domains
+        self.proxy = {key[len('proxy/'):]: value for key, value in stats.items() if key.startswith('proxy/')}
+        self.latency = sorted(crawler.latency_recorder.export(), key=lambda row: (row[0], sorted(row[1].items())))
+
+    def lines(self):
+        items = self.items or 1
+        lines = [
+            '[{0}] {1} pages {2} items in {3:.2f}s ({4})'.format(
+                self.name, self.pages, self.items, self.elapsed, self.finish_reason),
+            '  throughput: {0:.1f} pages/s  {1:.1f} items/s'.format(
+                self.pages / self.elapsed, self.items / self.elapsed),
+            '  redis: {0:.2f} commands/item  {1:.2f} round trips/item'.format(
+                self.commands / items, self.round_trips / items),
+            '  memory: max rss {0:.1f}MB  redis used {1}'.format(
+                self.rss, '{0:.1f}MB'.format(self.redis_bytes / 1048576.0) if self.redis_bytes else 'n/a'),
+        ]
+        if self.domains is not None and len(self.domains.pages) > 1:
+            for host in sorted(self.domains.pages):
+                pages, last = self.domains.pages[host], self.domains.last[host]
+                lines.append('  {0:<15} {1} pages  {2:.1f} pages/s  done at {3:.2f}s'.format(
+                    host, pages, pages / max(last, 0.001), last))
+        if self.proxy:
+            lines.append('  proxy: {0}'.format(' '.join('{0}={1}'.format(k, v) for k, v in sorted(self.proxy.items()))))
+        for stage, tags, fields in self.latency:
+            lines.append('  {0:<18} {1:<28} n={count} p50={p50}ms p95={p95}ms p99={p99}ms max={max}ms'.format(
+                stage, ','.join('{0}={1}'.format(k, v) for k, v in sorted(tags.items())), **fields))
+        return lines
+
+
+@defer.inlineCallbacks
+def run_phases(runner, settings, server, args, results):
+    """
+    先运行主爬虫采集全部列表页,再运行子爬虫采集全部详情页
+    """
+    list_pages = args.sites * args.chains * args.pages
+    for name, master, expected in (('master', 1, list_pages), ('slave', 0, list_pages * args.fanout)):
+        phase_settings = settings.copy()
+        phase_settings.set('CLOSESPIDER_ITEMCOUNT', expected, priority='cmdline')
+        crawler = Crawler(Spider, phase_settings)
+        domains = DomainCounter()
+        crawler.signals.connect(domains.response_received, signal=signals.response_received)
+        commands, round_trips = COUNTER.snapshot()
+        start = time.time()
+        yield runner.crawl(crawler, master=master)
+        elapsed = time.time() - start
+        end_commands, end_round_trips = COUNTER.snapshot()
+        results.append(PhaseResult(name, crawler, elapsed, end_commands - commands,
+                                   end_round_trips - round_trips, redis_memory(server), domains))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    package, names = script_package(args.sites)
+    settings = bench_settings(args, package, names)
+    configure_logging(settings)
+    domains = start_domains(args)
+    server = connection.from_settings(settings)
+    reset(server, args)
+    seed(server, settings, domains, args)
+    farm = None
+    if args.proxies:
+        farm = ProxyFarm(domains[0], args.proxies, args.proxy_ban_rate, args.proxy_delay).start()
+        seed_proxies(server, settings, farm, args)
+
+    results = []
+    runner = CrawlerRunner(settings)
+    d = run_phases(runner, settings, server, args, results)
+    d.addErrback(lambda failure: failure.printTraceback())
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
+    for site in domains:
+        site.stop()
+    if farm is not None:
+        farm.stop()
+
+    header = 'sites={0} chains={1} pages={2} fanout={3} size={4} concurrency={5} fake={6} {7}'.format(
+        args.sites, args.chains, args.pages, args.fanout, args.size, args.concurrency, args.fake, ' '.join(args.set))
+    if args.domains > 1:
+        header += ' domains={0} slow_domains={1} slow_delay={2}'.format(args.domains, args.slow_domains, args.slow_delay)
+    if args.proxies:
+        header += ' proxies={0} proxy_ban_rate={1} proxy_delay={2}'.format(
+            args.proxies, args.proxy_ban_rate, args.proxy_delay)
+    lines = [header]
+    for result in results:
+        lines.extend(result.lines())
+    report = '\n'.join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(report + '\n\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 21:10
+# @Author : shl
+# @File : site.py
+# @Desc : 压测用本地站点,生成列表页和详情页
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+class SyntheticSite:
+    """
+    本地HTTP站点
+    /list/{site_id}/{chain}/{page}: 列表页,fanout个详情链接,未到最后一页时带下一页链接
+    /detail/{site_id}/{chain}/{page}/{index}: 详情页,正文约size字节
+    delay为每个请求额外的耗时(秒),模拟慢站点
+    """
+
+    def __init__(self, pages=5, fanout=50, size=20000, host='127.0.0.1', port=0, delay=0.0):
+        self.pages = pages
+        self.fanout = fanout
+        self.size = size
+        self.delay = delay
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    def list_url(self, site_id, chain, page=1):
+        return '{0}/list/{1}/{2}/{3}'.format(self.base_url, site_id, chain, page)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def render_list(self, site_id, chain, page):
+        links = ''.join('<li><a class="detail" href="/detail/{0}/{1}/{2}/{3}">detail {3}</a></li>'.format(
+            site_id, chain, page, index) for index in range(self.fanout))
+        next_page = ''
+        if page < self.pages:
+            next_page = '<a class="next" href="/list/{0}/{1}/{2}">next</a>'.format(site_id, chain, page + 1)
+        return '<html><body><ul>{0}</ul>{1}</body></html>'.format(links, next_page)
+
+    def render_detail(self, site_id, chain, page, index):
+        title = 'site {0} chain {1} page {2} detail {3}'.format(site_id, chain, page, index)
+        paragraph = '<p>{0}</p>'.format('lorem ipsum dolor sit amet ' * 8)
+        content = paragraph * max(self.size // len(paragraph), 1)
+        return '<html><head><title>{0}</title></head><body><h1>{0}</h1><div id="content">{1}</div></body></html>'.format(
+            title, content)
+
+    def render(self, path):
+        """
+        按请求路径生成页面,path可以是完整链接(经代理转发的请求)
+        :param path:
+        :return: str 页面,路径不存在时为None
+        """
+        parts = urlparse(path).path.strip('/').split('/')
+        try:
+            numbers = [int(part) for part in parts[1:]]
+        except ValueError:
+            return None
+        if parts[0] == 'list' and len(numbers) == 3:
+            return self.render_list(*numbers)
+        if parts[0] == 'detail' and len(numbers) == 4:
+            return self.render_detail(*numbers)
+        return None
+
+    def _handler(self):
+        site = self
+
+        class Handler(PageHandler):
+            def do_GET(self):
+                if site.delay:
+                    time.sleep(site.delay)
+                self.send_page(site.render(self.path))
+
+        return Handler
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """
+    返回html页面的请求处理
+    """
+
+    def send_page(self, body, status=200):
+        if body is None:
+            self.send_error(404)
+            return
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,28 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 21:10
+# @Author : shl
+# @File : template.py
+# @Desc : 压测站点的模板脚本
+
+
+class Script:
+
+    def __init__(self, context):
+        self.context = context
+        self.response = context.response
+
+    def parse_list(self):
+        detail_urls = [self.response.urljoin(href) for href in self.response.css('a.detail::attr(href)').getall()]
+        next_page = self.response.css('a.next::attr(href)').get()
+        return {
+            'detail_urls': detail_urls,
+            'next_page_url': self.response.urljoin(next_page) if next_page else None,
+        }
+
+    def parse_detail(self):
+        return {
+            'title': self.response.css('h1::text').get(),
+            'content': ''.join(self.response.css('#content p::text').getall()),
+            'url': self.response.url,
+        }
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 19:10
+# @Author : shl
+# @File : codec.py
+# @Desc : 任务编码
+import hashlib
+import json
+
+import msgpack
+from scrapy_redis.utils import bytes_to_str
+
+JSON_PREFIX = b'{'
+
+
+class TaskCodec:
+    """
+    任务编码,msgpack格式下站点、模板、表名等任务头只在redis中保存一次,
+    队列中每条任务只保存 [任务头id, url, task_type, 其他逐条变化的字段],解码时兼容json格式任务
+    """
+    entry_fields = ('url', 'task_type', 'priority', 'depth', 'low_pages', 'watermark')  # 逐条变化、不放入任务头的字段
+
+    def __init__(self, server, headers_key, fmt='json'):
+        self.server = server
+        self.headers_key = headers_key  # 任务头hash, field为任务头id
+        self.fmt = fmt
+        self.headers = {}  # 任务头id -> 任务头
+
+    @classmethod
+    def from_settings(cls, server, settings, name):
+        headers_key = settings.get('REDIS_TASK_HEADERS_KEY', '%(name)s:task_headers') % {'name': name}
+        return cls(server, headers_key, settings.get('TASK_CODEC', 'json'))
+
+    @staticmethod
+    def header_id(header):
+        return hashlib.md5(json.dumps(header, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+    def register(self, header):
+        """
+        保存任务头,每个进程每种任务头只写一次redis
+        :param header:
+        :return: 任务头id
+        """
+        header_id = self.header_id(header)
+        if header_id not in self.headers:
+            self.server.hsetnx(self.headers_key, header_id, msgpack.packb(header))
+            self.headers[header_id] = header
+        return header_id
+
+    def encode(self, task):
+        """
+        任务编码
+        :param task: dict 任务信息
+        :return:
+        """
+        if self.fmt == 'json':
+            return json.dumps(task)
+        header = {}
+        extra = {}
+        for key, value in task.items():
+            if key not in self.entry_fields:
+                header[key] = value
+            elif key not in ('url', 'task_type'):
+                extra[key] = value
+        entry = [self.register(header), task.get('url', ''), task.get('task_type')]
+        if extra:
+            entry.append(extra)
+        return msgpack.packb(entry)
+
+    def decode(self, data):
+        """
+        任务解码,兼容json格式
+        :param data: bytes redis任务数据
+        :return: dict 任务信息
+        """
+        if isinstance(data, str) or data[:1] == JSON_PREFIX:
+            return json.loads(bytes_to_str(data))
+        entry = msgpack.unpackb(data)
+        task = dict(self.get_header(entry[0]))
+        task['url'] = entry[1]
+        task['task_type'] = entry[2]
+        if len(entry) > 3:
+            task.update(entry[3])
+        return task
+
+    def load_headers(self, datas):
+        """
+        批量加载缓存中缺少的任务头,在获取任务的线程中调用,reactor线程解码时不再逐条访问redis
+        :param datas: redis任务数据列表
+        :return: int 加载数
+        """
+        missing = set()
+        for data in datas:
+            if isinstance(data, str) or data[:1] == JSON_PREFIX:
+                continue
+            try:
+                header_id = msgpack.unpackb(data)[0]
+            except Exception:  # 格式错误的任务在解码时处理
+                continue
+            if header_id not in self.headers:
+                missing.add(header_id)
+        if not missing:
+            return 0
+        missing = list(missing)
+        loaded = 0
+        for header_id, data in zip(missing, self.server.hmget(self.headers_key, missing)):
+            if data is not None:
+                self.headers[header_id] = msgpack.unpackb(data)
+                loaded += 1
+        return loaded
+
+    def get_header(self, header_id):
+        header = self.headers.get(header_id)
+        if header is None:
+            data = self.server.hget(self.headers_key, header_id)
+            if data is None:
+                raise ValueError('任务头不存在：{0}'.format(header_id))
+            header = self.headers[header_id] = msgpack.unpackb(data)
+        return header
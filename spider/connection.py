@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 23:20
+# @Author : shl
+# @File : connection.py
+# @Desc : crawler内共用的redis连接
+import logging
+
+from redis.connection import HIREDIS_AVAILABLE, HiredisParser, PythonParser
+from scrapy import signals
+from scrapy.utils.misc import load_object
+from scrapy_redis import connection, defaults
+
+logger = logging.getLogger(__name__)
+
+
+class RedisRegistry:
+    """
+    crawler内的redis客户端注册表,爬虫、管道、中间件按redis地址共用同一个客户端(同一个连接池),
+    引擎停止后统一断开,单个组件关闭时不再影响其他组件
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.clients = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        registry = getattr(crawler, 'redis_registry', None)
+        if registry is None:
+            registry = crawler.redis_registry = cls(crawler.settings)
+            crawler.signals.connect(registry.close, signal=signals.engine_stopped)
+        return registry
+
+    def pool_params(self):
+        """
+        连接池参数: 连接数上限、健康检查间隔、TCP keepalive、响应解析器
+        :return: dict 合并到 REDIS_PARAMS
+        """
+        settings = self.settings
+        params = {}
+        max_connections = settings.getint('REDIS_POOL_MAX_CONNECTIONS', 0)
+        if max_connections:
+            params['max_connections'] = max_connections
+        health_check_interval = settings.getint('REDIS_HEALTH_CHECK_INTERVAL', 0)
+        if health_check_interval:
+            params['health_check_interval'] = health_check_interval
+        if settings.getbool('REDIS_SOCKET_KEEPALIVE'):
+            params['socket_keepalive'] = True
+        hiredis = settings.get('REDIS_HIREDIS')
+        if hiredis is not None:
+            if settings.getbool('REDIS_HIREDIS') and not HIREDIS_AVAILABLE:
+                logger.warning('REDIS_HIREDIS已开启但未安装hiredis,使用python解析器')
+            elif settings.getbool('REDIS_HIREDIS'):
+                params['parser_class'] = HiredisParser
+            else:
+                params['parser_class'] = PythonParser
+        return params
+
+    def get(self, url=None):
+        """
+        获取redis客户端
+        :param url: redis地址,默认 REDIS_URL
+        :return:
+        """
+        key = url or self.settings.get('REDIS_URL')
+        server = self.clients.get(key)
+        if server is None:
+            server = self.clients[key] = connection.get_redis(**self.redis_params(url))
+        return server
+
+    def redis_params(self, url=None):
+        """
+        与 scrapy_redis.connection.get_redis_from_settings 相同的参数,再加上连接池参数
+        :param url:
+        :return:
+        """
+        params = defaults.REDIS_PARAMS.copy()
+        params.update(self.settings.getdict('REDIS_PARAMS'))
+        for source, dest in connection.SETTINGS_PARAMS_MAP.items():
+            value = self.settings.get(source)
+            if value:
+                params[dest] = value
+        if isinstance(params.get('redis_cls'), str):
+            params['redis_cls'] = load_object(params['redis_cls'])
+        params.update(self.pool_params())
+        if url:
+            params['url'] = url
+        return params
+
+    def close(self):
+        clients, self.clients = self.clients, {}
+        for server in clients.values():
+            server.connection_pool.disconnect()
+
+
+def get_redis(crawler, url=None):
+    """
+    crawler内共用的redis客户端
+    :param crawler:
+    :param url: redis地址,默认 REDIS_URL
+    :return:
+    """
+    return RedisRegistry.from_crawler(crawler).get(url)
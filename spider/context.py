@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 15:40
+# @Author : shl
+# @File : context.py
+# @Desc : 任务上下文
+
+
+class TaskContext:
+    """
+    单个响应的任务上下文,传给模板脚本并随item进入管道,多并发时各请求互不干扰
+    """
+
+    def __init__(self, task, response=None, spider=None):
+        self.task = task
+        self.response = response
+        self.spider = spider
+        self._meta = None
+
+    @classmethod
+    def from_response(cls, response, spider=None):
+        return cls(response.meta.get('task', {}), response, spider)
+
+    @property
+    def task_type(self):
+        return self.task.get('task_type', '')
+
+    @property
+    def site_id(self):
+        return self.task.get('site_id')
+
+    @property
+    def template_id(self):
+        return self.task.get('template_id')
+
+    @property
+    def meta(self):
+        if self.response is None:
+            return self._meta or {}
+        return self.response.meta
+
+    @property
+    def member(self):
+        """
+        可靠队列中的处理中记录,数据保存后用于确认任务
+        """
+        return self.meta.get('redis_member')
+
+    @property
+    def html(self):
+        """
+        响应文本,首次访问时解码,由响应缓存,不要在脚本中另存副本
+        """
+        if self.response is None:
+            return ''
+        return self.response.text
+
+    @property
+    def selector(self):
+        """
+        响应的选择器,首次访问时解析
+        """
+        if self.response is None:
+            return None
+        return self.response.selector
+
+    def detach(self):
+        """
+        解析完成后释放响应,只保留meta
+        :return:
+        """
+        if self.response is not None:
+            self._meta = self.response.meta
+            self.response = None
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 23:30
+# @Author : shl
+# @File : downloader.py
+# @Desc : 等待并发/令牌的请求不占用全局并发的下载器
+from scrapy.core.downloader import Downloader
+
+
+class ParkingDownloader(Downloader):
+    """
+    请求进入下载器后先经过下载中间件,在中间件中等待并发或令牌时已计入 Downloader.active,
+    慢站点的等待请求会占满 CONCURRENT_REQUESTS,其他站点的请求无法调度(队头阻塞)
+    中间件通过 park 登记等待中的请求(停靠),停靠的请求不计入全局并发,引擎继续调度其他请求,
+    停靠总数不超过 DOWNLOADER_MAX_PARKED,超过后的等待请求照常占用并发,限制内存中积压的请求数,
+    停靠的请求等到并发/令牌后重新计入,全局并发最多短暂超出停靠数
+    """
+
+    def __init__(self, crawler):
+        super(ParkingDownloader, self).__init__(crawler)
+        self.crawler = crawler
+        self.parked = 0
+        self.max_parked = self.settings.getint('DOWNLOADER_MAX_PARKED') or self.total_concurrency * 4
+
+    def needs_backout(self):
+        return len(self.active) - self.parked >= self.total_concurrency
+
+    def park(self, d):
+        """
+        请求在中间件中等待d期间不占用全局并发,并通知引擎调度下一个请求
+        :param d: 等待并发/令牌的Deferred
+        :return: d
+        """
+        if self.parked >= self.max_parked:
+            return d
+        self.parked += 1
+        d.addBoth(self._unpark)
+        slot = self.crawler.engine.slot
+        if slot is not None:
+            slot.nextcall.schedule()
+        return d
+
+    def _unpark(self, result):
+        self.parked -= 1
+        return result
+
+
+def park(crawler, d):
+    """
+    使用 ParkingDownloader 时停靠等待中的请求,其他下载器不处理
+    :param crawler:
+    :param d:
+    :return: d
+    """
+    downloader = getattr(crawler.engine, 'downloader', None)
+    if isinstance(downloader, ParkingDownloader):
+        downloader.park(d)
+    return d
+
+
+def parked(crawler):
+    """
+    停靠中的请求数
+    :param crawler:
+    :return:
+    """
+    return getattr(getattr(crawler.engine, 'downloader', None), 'parked', 0)
@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 22:50
+# @Author : shl
+# @File : executor.py
+# @Desc : 模板脚本解析执行器,按模板把解析放到线程池或进程池中执行
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from itemadapter import ItemAdapter
+from scrapy import Request
+from scrapy.http import TextResponse
+from twisted.internet import defer, reactor
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+from spider.context import TaskContext
+from spider.default import LIST_TASK
+from spider.loader import ScriptRegistry
+
+INLINE = 'inline'  # reactor线程中解析
+THREAD = 'thread'  # 线程池,适合解析时释放GIL的脚本
+PROCESS = 'process'  # 进程池,适合CPU密集的脚本
+
+_registry = None  # 进程池子进程中的模板脚本缓存
+
+
+def run_script(script_class, context):
+    """
+    执行模板脚本解析
+    :param script_class: 模板脚本类
+    :param context: 任务上下文
+    :return: dict 解析结果
+    """
+    _class = script_class(context)
+    if context.task_type == LIST_TASK:
+        data = _class.parse_list()
+    else:
+        data = _class.parse_detail()
+    return None if data is None else ItemAdapter(data).asdict()
+
+
+def parse_in_process(package, check_interval, version, task, response_cls, url, status, headers, body, encoding):
+    """
+    子进程中重建响应与任务上下文并解析
+    :param package: 模板脚本包
+    :param check_interval: 检查模板脚本变化的间隔
+    :param version: 主进程中该模板的版本号,变化时子进程重新加载脚本
+    :return: (解析结果, 耗时毫秒)
+    """
+    global _registry
+    if _registry is None:
+        _registry = ScriptRegistry(package, check_interval)
+    site_id, template_id = task.get('site_id'), task.get('template_id')
+    _registry.versions[ScriptRegistry.script_name(site_id, template_id)] = version
+    kwargs = {'url': url, 'status': status, 'headers': headers, 'body': body,
+              'request': Request(url, meta={'task': task})}
+    if issubclass(response_cls, TextResponse):
+        kwargs['encoding'] = encoding
+    response = response_cls(**kwargs)
+    start = time.time()
+    data = run_script(_registry.get(site_id, template_id), TaskContext(task, response))
+    return data, (time.time() - start) * 1000
+
+
+class ParseExecutor:
+    """
+    按 template_id 选择解析方式,线程池/进程池中解析时返回Deferred,下载不再被解析阻塞
+    """
+
+    def __init__(self, scripts, modes=None, default_mode=INLINE, thread_workers=4, process_workers=0):
+        self.scripts = scripts
+        self.modes = {str(k): v for k, v in (modes or {}).items()}
+        self.default_mode = default_mode
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers or os.cpu_count() or 1
+        self.thread_pool = None
+        self.process_pool = None
+
+    @classmethod
+    def from_settings(cls, settings, scripts):
+        return cls(
+            scripts,
+            modes=settings.getdict('PARSE_EXECUTORS'),
+            default_mode=settings.get('PARSE_EXECUTOR', INLINE),
+            thread_workers=settings.getint('PARSE_THREAD_WORKERS', 4),
+            process_workers=settings.getint('PARSE_PROCESS_WORKERS', 0),
+        )
+
+    def mode(self, template_id):
+        return self.modes.get(str(template_id), self.default_mode)
+
+    def submit(self, context):
+        """
+        在线程池或进程池中解析
+        :param context: 任务上下文
+        :return: Deferred (解析结果, 耗时毫秒)
+        """
+        if self.mode(context.template_id) == PROCESS:
+            return self._submit_process(context)
+        return self._submit_thread(context)
+
+    def _submit_thread(self, context):
+        if self.thread_pool is None:
+            self.thread_pool = ThreadPool(1, self.thread_workers, name='parse')
+            self.thread_pool.start()
+        script_class = self.scripts.get(context.site_id, context.template_id)
+        return deferToThreadPool(reactor, self.thread_pool, self._run_thread, script_class, context)
+
+    @staticmethod
+    def _run_thread(script_class, context):
+        start = time.time()
+        data = run_script(script_class, context)
+        return data, (time.time() - start) * 1000
+
+    def _submit_process(self, context):
+        if self.process_pool is None:
+            # spawn启动子进程,避免fork复制reactor与redis连接
+            self.process_pool = ProcessPoolExecutor(self.process_workers, multiprocessing.get_context('spawn'))
+        response = context.response
+        name = self.scripts.script_name(context.site_id, context.template_id)
+        future = self.process_pool.submit(
+            parse_in_process, self.scripts.package, self.scripts.check_interval, self.scripts.versions.get(name),
+            context.task, type(response), response.url, response.status, dict(response.headers), response.body,
+            getattr(response, 'encoding', None),
+        )
+        d = defer.Deferred()
+
+        def _done(f):
+            error = f.exception()
+            if error is not None:
+                reactor.callFromThread(d.errback, error)
+            else:
+                reactor.callFromThread(d.callback, f.result())
+        future.add_done_callback(_done)
+        return d
+
+    def close(self):
+        if self.thread_pool is not None:
+            self.thread_pool.stop()
+            self.thread_pool = None
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False)
+            self.process_pool = None
@@ -4,24 +4,254 @@
 # @Author : shl
 # @File : extensions.py
 # @Desc :
+import json
 import logging
+import socket
+import time
+from collections import deque
+
 from scrapy import signals
 import datetime
-from threading import Timer
 from influxdb import InfluxDBClient
+from twisted.internet import defer, reactor
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
+
+from spider.metrics import LatencyRecorder
 
 logger = logging.getLogger(__name__)
 
+# 统计数据报的最大字节数,launcher按该大小接收(twisted默认只接收8192字节,超出部分被截断)
+STATS_MAX_DATAGRAM = 65000
+
+
+class InfluxDBExporter:
+    """
+    influxdb数据点缓冲后由后台单个线程批量写入,写入失败按指数退避重试,
+    influxdb不可用时缓冲写满后丢弃最早的数据点,不阻塞也不中断采集,关闭时最多等待 close_timeout 秒
+    """
+
+    def __init__(self, client, max_points=10000, batch_size=500, flush_interval=5, max_backoff=300, stats=None,
+                 close_timeout=30):
+        self.client = client
+        self.points = deque()
+        self.max_points = max_points  # 缓冲的最大数据点数
+        self.batch_size = batch_size  # 每次写入的数据点数
+        self.flush_interval = flush_interval  # 写入间隔(秒)
+        self.max_backoff = max_backoff  # 最大退避时间(秒)
+        self.close_timeout = close_timeout  # 关闭时等待写入剩余数据点的最长时间(秒)
+        self.stats = stats
+        self.backoff = 0
+        self.next_try = 0
+        self.writing = None
+        self.flush_task = LoopingCall(self.flush)
+
+    @classmethod
+    def from_settings(cls, settings, stats=None, params=None):
+        """
+        :param settings:
+        :param stats:
+        :param params: influxdb连接参数,默认 INFLUXDB_PARAMS
+        :return:
+        """
+        params = dict(params or settings.getdict('INFLUXDB_PARAMS'))
+        params.setdefault('timeout', settings.getfloat('INFLUXDB_TIMEOUT', 10))  # 未设置超时时写入可能一直阻塞
+        return cls(
+            InfluxDBClient(**params),
+            max_points=settings.getint('INFLUXDB_MAX_POINTS', 10000),
+            batch_size=settings.getint('INFLUXDB_BATCH_SIZE', 500),
+            flush_interval=settings.getfloat('INFLUXDB_FLUSH_INTERVAL', 5),
+            max_backoff=settings.getfloat('INFLUXDB_MAX_BACKOFF', 300),
+            stats=stats,
+            close_timeout=settings.getfloat('INFLUXDB_CLOSE_TIMEOUT', 30),
+        )
+
+    def start(self):
+        self.flush_task.start(self.flush_interval, now=False)
+
+    def add(self, point):
+        """
+        数据点放入缓冲
+        :param point:
+        :return:
+        """
+        if len(self.points) >= self.max_points:
+            self.points.popleft()
+            self._inc_stat('influxdb/dropped')
+        self.points.append(point)
+
+    def flush(self):
+        """
+        后台写入一批数据点,同一时间只有一个写入
+        :return: Deferred
+        """
+        if self.writing is not None:
+            return self.writing
+        if not self.points or time.time() < self.next_try:
+            return defer.succeed(None)
+        batch = [self.points.popleft() for _ in range(min(self.batch_size, len(self.points)))]
+        self.writing = deferToThread(self._write, batch)
+        self.writing.addCallbacks(self._written, self._write_failed, errbackArgs=(batch,))
+        return self.writing
+
+    def _write(self, batch):
+        if not self.client.write_points(batch):
+            raise IOError('写入influxdb失败！')
+        return len(batch)
+
+    def _written(self, count):
+        self.writing = None
+        self.backoff = 0
+        self._inc_stat('influxdb/written', count)
+        if len(self.points) >= self.batch_size:
+            reactor.callLater(0, self.flush)
+
+    def _write_failed(self, failure, batch):
+        self.writing = None
+        self.backoff = min(max(self.backoff * 2, 1), self.max_backoff)
+        self.next_try = time.time() + self.backoff
+        free = self.max_points - len(self.points)
+        if free < len(batch):
+            self._inc_stat('influxdb/dropped', len(batch) - free)
+        self.points.extendleft(reversed(batch[len(batch) - max(free, 0):]))
+        self._inc_stat('influxdb/error')
+        logger.warning('写入influxdb失败,{0}秒后重试：{1}'.format(self.backoff, failure.getErrorMessage()))
+
+    def _inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
+
+    def close(self):
+        """
+        停止定时写入并尝试写入剩余数据点,超过 close_timeout 秒后放弃剩余数据点
+        :return: Deferred
+        """
+        if self.flush_task.running:
+            self.flush_task.stop()
+        closed = defer.Deferred()
+        timeout_call = reactor.callLater(self.close_timeout, self._close_timeout, closed)
+        d = self.writing or defer.succeed(None)
+        d.addBoth(lambda _: self._flush_all())
+        d.addBoth(self._closed, closed, timeout_call)
+        return closed
+
+    @staticmethod
+    def _closed(_, closed, timeout_call):
+        if timeout_call.active():
+            timeout_call.cancel()
+            closed.callback(None)
+
+    def _close_timeout(self, closed):
+        dropped = len(self.points)
+        self.points.clear()
+        self._inc_stat('influxdb/dropped', dropped)
+        logger.warning('写入influxdb超时({0}秒),放弃剩余数据点：{1}个'.format(self.close_timeout, dropped))
+        closed.callback(None)
+
+    def _flush_all(self):
+        self.next_try = 0
+        self.batch_size = max(self.batch_size, len(self.points))
+        d = self.flush()
+        d.addErrback(lambda _: None)
+        return d
+
+
+class StatsSender:
+    """
+    由launcher启动时,统计数据通过unix datagram发给launcher汇总后统一写入influxdb,
+    接口与 InfluxDBExporter 一致,子进程不再各自连接influxdb,耗时直方图按编码后的大小拆分为多个数据报,
+    发送缓冲区已满时数据报暂存后重试
+    """
+
+    def __init__(self, path, worker_id=None, max_datagram=STATS_MAX_DATAGRAM, max_pending=100):
+        self.path = path
+        self.worker_id = worker_id
+        self.max_datagram = max_datagram
+        self.pending = deque(maxlen=max_pending)  # 等待发送的数据报,超过后丢弃最早的
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self._drain_call = None
+
+    def start(self):
+        pass
+
+    def send(self, message):
+        message['worker'] = self.worker_id
+        data = json.dumps(message).encode('utf-8')
+        if len(data) > self.max_datagram:
+            logger.warning('统计数据过大({0}字节),已丢弃'.format(len(data)))
+            return
+        self.pending.append(data)
+        self._drain()
+
+    def _drain(self):
+        while self.pending:
+            try:
+                self.sock.sendto(self.pending[0], self.path)
+            except BlockingIOError:  # 一次发送的直方图较多时发送缓冲区会写满,稍后重试
+                if not (self._drain_call and self._drain_call.active()):
+                    self._drain_call = reactor.callLater(0.1, self._drain)
+                return
+            except (OSError, ValueError) as e:  # launcher已退出时丢弃,不阻塞采集
+                logger.warning('统计数据发送失败({0}个数据报)：{1}'.format(len(self.pending), str(e)))
+                self.pending.clear()
+                return
+            self.pending.popleft()
+
+    def add(self, point):
+        self.send({'point': point})
+
+    def add_stats(self, spider_name, point_time, deltas, gauges, histograms):
+        """
+        发送本统计周期的计数增量、当前值与耗时直方图
+        :param spider_name:
+        :param point_time:
+        :param deltas: 本周期增量,汇总时求和
+        :param gauges: 当前值,汇总时各进程取最新值后求和
+        :param histograms: [(stage, tags, LatencyHistogram), ...]
+        :return:
+        """
+        self.send({'spider_name': spider_name, 'time': point_time, 'deltas': deltas, 'gauges': gauges})
+        head = {'spider_name': spider_name, 'time': point_time, 'latency': [], 'worker': self.worker_id}
+        budget = self.max_datagram - len(json.dumps(head).encode('utf-8'))
+        batch, size = [], 0
+        for stage, tags, histogram in histograms:
+            entry = (stage, {k: v for k, v in tags.items() if v is not None}, histogram.state())
+            entry_size = len(json.dumps(entry).encode('utf-8')) + 2  # 列表元素之间的 ", "
+            if batch and size + entry_size > budget:
+                self.send({'spider_name': spider_name, 'time': point_time, 'latency': batch})
+                batch, size = [], 0
+            batch.append(entry)
+            size += entry_size
+        if batch:
+            self.send({'spider_name': spider_name, 'time': point_time, 'latency': batch})
+
+    def close(self):
+        if self._drain_call and self._drain_call.active():
+            self._drain_call.cancel()
+        self._drain()
+        if self.pending:
+            logger.warning('统计数据未发送完,已丢弃：{0}个数据报'.format(len(self.pending)))
+        self.sock.close()
+        return defer.succeed(None)
+
 
 class SpiderStatueStatistics:
     """
     用于统计采集状态的统计
     """
     def __init__(self, crawler, influxdb_params, interval):
-        self.exit_code = False
         self.interval = interval
         self.crawler = crawler
-        self.client = InfluxDBClient(**influxdb_params)
+        settings = crawler.settings
+        if settings.get('STATS_AGGREGATE_SOCKET'):  # 由launcher汇总后写入influxdb
+            self.client = None
+            self.exporter = StatsSender(settings.get('STATS_AGGREGATE_SOCKET'), settings.get('WORKER_ID'))
+        else:
+            self.exporter = InfluxDBExporter.from_settings(settings, crawler.stats, influxdb_params)
+            self.client = self.exporter.client
+        self.stat_task = LoopingCall(self.handle_stat)
+        self.latency = LatencyRecorder.from_crawler(crawler)
         self.stats_keys = set()
         self.cur_d = {
             'log_info': 0,
@@ -36,6 +266,9 @@ class SpiderStatueStatistics:
             'responsed': 0,
             'item': 0,
             'filtered': 0,
+            'mongo_inserted': 0,
+            'mongo_updated': 0,
+            'mongo_unchanged': 0,
         }
 
     @classmethod
@@ -63,8 +296,8 @@ class SpiderStatueStatistics:
                 'spider_name': spider.name
             }
         }
-        if not self.client.write_points([influxdb_d]):
-            raise IOError('写入influxdb失败！')
+        self.exporter.add(influxdb_d)
+        return self.exporter.close()
 
     def spider_opened(self, spider):
         influxdb_d = {
@@ -78,15 +311,16 @@ class SpiderStatueStatistics:
                 'spider_name': spider.name
             }
         }
-        if not self.client.write_points([influxdb_d]):
-            raise IOError('写入influxdb失败！')
+        self.exporter.add(influxdb_d)
+        self.exporter.start()
         logger.info('influxdb start is starting')
 
     def engine_started(self):
-        Timer(self.interval, self.handle_stat).start()
+        self.stat_task.start(self.interval, now=False)
 
     def engine_stopped(self):
-        self.exit_code = True
+        if self.stat_task.running:
+            self.stat_task.stop()
 
     def handle_stat(self):
         stats = self.crawler.stats.get_stats()
@@ -106,20 +340,44 @@ class SpiderStatueStatistics:
             'depth': stats.get('request_depth_max', 0),
             'filtered': stats.get('bloomfilter/filtered', 0),
             'enqueued': stats.get('scheduler/enqueued/redis', 0),
+            'mongo_inserted': stats.get('mongo/inserted', 0),
+            'mongo_updated': stats.get('mongo/updated', 0),
+            'mongo_unchanged': stats.get('mongo/unchanged', 0),
             'spider_name': self.crawler.spider.name
         }
         for key in self.cur_d:
             d[key], self.cur_d[key] = d[key] - self.cur_d[key], d[key]
+        self.stats_keys.update(stats.keys())
+        point_time = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        if isinstance(self.exporter, StatsSender):
+            gauges = {key: value for key, value in d.items() if key not in self.cur_d and key != 'spider_name'}
+            self.exporter.add_stats(self.crawler.spider.name, point_time,
+                                    {key: d[key] for key in self.cur_d}, gauges, self.latency.drain())
+            return
         influxdb_d = {
             "measurement": "newspider",
-            "time": datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            "time": point_time,
             "tags": {
                 'spider_name': self.crawler.spider.name
             },
             "fields": d
         }
-        if not self.client.write_points([influxdb_d]):
-            raise IOError('写入influxdb失败！')
-        self.stats_keys.update(stats.keys())
-        if not self.exit_code:
-            Timer(self.interval, self.handle_stat).start()
+        self.exporter.add(influxdb_d)
+        self.export_latency(point_time)
+
+    def export_latency(self, point_time):
+        """
+        各环节耗时分位数,与计数统计写入同一measurement,以stage等标签区分
+        :param point_time:
+        :return:
+        """
+        spider_name = self.crawler.spider.name
+        for stage, tags, fields in self.latency.export():
+            point_tags = {'spider_name': spider_name, 'stage': stage}
+            point_tags.update((key, str(value)) for key, value in tags.items() if value is not None)
+            self.exporter.add({
+                "measurement": "newspider",
+                "time": point_time,
+                "tags": point_tags,
+                "fields": fields
+            })
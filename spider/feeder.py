@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 18:05
+# @Author : shl
+# @File : feeder.py
+# @Desc : redis任务自适应补充
+import logging
+from collections import deque
+
+from scrapy import signals
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
+
+from spider.downloader import parked
+
+logger = logging.getLogger(__name__)
+
+
+class TaskFeeder:
+    """
+    保持目标数量的在途请求: 下载槽位一空出就补充任务,
+    根据下载耗时与空闲槽位调整每批获取的任务数,并在后台预取下一批任务,
+    爬虫关闭时停止补充,预取但未发出请求的任务放回redis
+    """
+
+    def __init__(self, spider, target, interval=0.5, min_batch=1, max_batch=200, ewma_alpha=0.2):
+        self.spider = spider
+        self.crawler = spider.crawler
+        self.target = target  # 目标在途请求数
+        self.interval = interval  # 检查间隔(秒)
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.ewma_alpha = ewma_alpha
+        self.buffer = deque()  # 预取的任务
+        self.inflight = 0  # 已调度但还未离开下载器的请求数
+        self.downloading = 0
+        self.latency = None  # 下载耗时的指数加权平均(秒)
+        self.fetching = False
+        self.stopped = False
+        self.feed_task = None
+        self._fetch_d = None
+
+    @classmethod
+    def from_spider(cls, spider):
+        settings = spider.settings
+        target = settings.getint('FEEDER_TARGET') or settings.getint('CONCURRENT_REQUESTS') * 2
+        return cls(
+            spider, target,
+            interval=settings.getfloat('FEEDER_INTERVAL', 0.5),
+            min_batch=settings.getint('FEEDER_MIN_BATCH', 1),
+            max_batch=settings.getint('FEEDER_MAX_BATCH', 200),
+        )
+
+    def start(self):
+        self.crawler.signals.connect(self.request_scheduled, signal=signals.request_scheduled)
+        self.crawler.signals.connect(self.request_dropped, signal=signals.request_dropped)
+        self.crawler.signals.connect(self.request_reached, signal=signals.request_reached_downloader)
+        self.crawler.signals.connect(self.request_left, signal=signals.request_left_downloader)
+        self.crawler.signals.connect(self.response_received, signal=signals.response_received)
+        self.crawler.signals.connect(self.stop, signal=signals.spider_closed)
+        self.feed_task = LoopingCall(self.feed)
+        self.feed_task.start(self.interval)
+
+    def stop(self):
+        """
+        停止补充任务,等待进行中的预取完成后把缓冲区的任务放回redis
+        :return: Deferred
+        """
+        if self.stopped:
+            return None
+        self.stopped = True
+        if self.feed_task and self.feed_task.running:
+            self.feed_task.stop()
+        d = self._fetch_d if self.fetching else defer.succeed(None)
+        d.addCallback(lambda _: self.release())
+        return d
+
+    def closing(self):
+        """
+        爬虫是否已停止或正在关闭,关闭中调度的请求不会被下载
+        :return:
+        """
+        slot = self.crawler.engine.slot
+        return self.stopped or slot is None or slot.closing is not None
+
+    def release(self):
+        """
+        预取但未发出请求的任务放回redis(可靠模式下同时移出处理中zset)
+        :return: Deferred
+        """
+        datas, self.buffer = list(self.buffer), deque()
+        if not datas:
+            return None
+        d = deferToThread(self.spider.release_tasks, datas)
+        d.addCallbacks(self._released, self._release_failed, errbackArgs=(len(datas),))
+        return d
+
+    def _released(self, count):
+        self.crawler.stats.inc_value('feeder/released', count)
+        logger.info('预取的任务已放回队列：{0}条'.format(count))
+
+    @staticmethod
+    def _release_failed(failure, count):
+        logger.error('预取的任务放回队列失败({0}条)：{1}'.format(count, failure.getErrorMessage()))
+
+    def request_scheduled(self, request, spider):
+        self.inflight += 1
+
+    def request_dropped(self, request, spider):
+        self.inflight -= 1
+
+    def request_reached(self, request, spider):
+        self.downloading += 1
+
+    def request_left(self, request, spider):
+        self.inflight -= 1
+        self.downloading -= 1
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is None:
+            return
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.ewma_alpha * (latency - self.latency)
+
+    def batch_size(self):
+        """
+        本批次获取的任务数: 空闲槽位 + 下一次获取完成前预计完成的下载数
+        :return:
+        """
+        free = max(self.target - self.inflight + parked(self.crawler) - len(self.buffer), 0)
+        expected = 0
+        if self.latency:
+            expected = int(self.downloading * self.interval / self.latency)
+        return max(self.min_batch, min(free + expected, self.max_batch))
+
+    def feed(self):
+        """
+        用预取的任务补满在途请求,预取不足时后台获取下一批
+        :return:
+        """
+        if self.closing():
+            return
+        free = self.target - self.inflight + parked(self.crawler)  # 停靠等待的请求不占用目标在途数
+        while free > 0 and self.buffer:
+            data = self.buffer.popleft()
+            try:
+                request = self.spider.make_request_from_data(data)
+            except Exception as e:  # 单条任务格式错误时跳过,不能中断补充任务的循环
+                self.crawler.stats.inc_value('feeder/bad_task')
+                logger.error('任务解析失败：{0} {1}'.format(repr(e), data[:200]))
+                self.spider.fail_task(data, 'decode')
+                continue
+            if request:
+                self.crawler.engine.crawl(request)
+                free -= 1
+        if not self.fetching and len(self.buffer) < self.target:
+            self.prefetch()
+
+    def prefetch(self):
+        batch_size = self.batch_size()
+        self.spider.redis_batch_size = batch_size
+        self.crawler.stats.set_value('feeder/batch_size', batch_size)
+        self.fetching = True
+        d = deferToThread(self.spider.fetch_tasks, self.spider.redis_key, batch_size)
+        d.addCallbacks(self._fetched, self._fetch_failed)
+        self._fetch_d = d
+
+    def _fetched(self, datas):
+        self.fetching = False
+        self.buffer.extend(datas)  # 关闭中获取到的任务也放入缓冲区,由stop放回redis
+        if datas and not self.closing():
+            self.feed()
+
+    def _fetch_failed(self, failure):
+        self.fetching = False
+        logger.error('任务获取失败：{0}'.format(failure.getErrorMessage()))
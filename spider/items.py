@@ -10,3 +10,17 @@ class SpiderItem(scrapy.Item):
     # define the fields for your item here like:
     # name = scrapy.Field()
     pass
+
+
+class TaskItem(dict):
+    """
+    模板脚本解析结果,附带所属请求的任务上下文
+    """
+
+    def __init__(self, data, context):
+        super(TaskItem, self).__init__(data)
+        self.context = context
+
+    @property
+    def task(self):
+        return self.context.task
@@ -0,0 +1,454 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 10:12
+# @Author : shl
+# @File : judge.py
+# @Desc : 详情链接判重存储
+import argparse
+import hashlib
+import logging
+import math
+import time
+
+from scrapy.utils.misc import load_object
+
+logger = logging.getLogger(__name__)
+
+# 判重与入队在redis服务端一次完成,多个主爬虫共用同一判重键时也不会重复下发详情任务
+# 设置了重采周期的链接在过期zset中记录到期时间,每次调用顺带清理一批已到期的记录
+# KEYS[1]: 判重hash  KEYS[2]: 详情任务队列  KEYS[3]: 过期zset  KEYS[4]: 站点集合(按站点拆分队列时使用)
+# ARGV[1]: 判重时间戳  ARGV[2]: 重采周期(秒,0为永不过期)  ARGV[3]: 单次最多清理的过期记录数
+# ARGV[4]: 站点id(为空时不登记站点)  ARGV[5..]: field, task 交替排列
+# 返回认领成功的序号(从1开始)
+CLAIM_AND_ENQUEUE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now, 'LIMIT', 0, tonumber(ARGV[3]))
+for _, field in ipairs(expired) do
+    redis.call('HDEL', KEYS[1], field)
+    redis.call('ZREM', KEYS[3], field)
+end
+local claimed = {}
+local n = 0
+for i = 5, #ARGV, 2 do
+    n = n + 1
+    local seen = redis.call('HGET', KEYS[1], ARGV[i])
+    if (not seen) or (window > 0 and now - tonumber(seen) >= window) then
+        redis.call('HSET', KEYS[1], ARGV[i], now)
+        redis.call('RPUSH', KEYS[2], ARGV[i + 1])
+        if window > 0 then
+            redis.call('ZADD', KEYS[3], now + window, ARGV[i])
+        end
+        claimed[#claimed + 1] = n
+    end
+end
+if #claimed > 0 and ARGV[4] ~= '' then
+    redis.call('SADD', KEYS[4], ARGV[4])
+end
+return claimed
+"""
+
+# KEYS[1]: 布隆过滤位图  KEYS[2]: 详情任务队列  KEYS[3]: 已写入链接计数  KEYS[4]: 站点集合
+# ARGV[1]: 哈希函数个数k  ARGV[2]: 站点id(为空时不登记站点)  ARGV[3..]: task, offset_1..offset_k 依次排列
+BLOOM_CLAIM_AND_ENQUEUE_SCRIPT = """
+local k = tonumber(ARGV[1])
+local claimed = {}
+local n = 0
+local i = 3
+while i <= #ARGV do
+    n = n + 1
+    local exists = true
+    for j = 1, k do
+        if redis.call('GETBIT', KEYS[1], ARGV[i + j]) == 0 then
+            exists = false
+            break
+        end
+    end
+    if not exists then
+        for j = 1, k do
+            redis.call('SETBIT', KEYS[1], ARGV[i + j], 1)
+        end
+        redis.call('RPUSH', KEYS[2], ARGV[i])
+        claimed[#claimed + 1] = n
+    end
+    i = i + k + 1
+end
+if #claimed > 0 then
+    redis.call('INCRBY', KEYS[3], #claimed)
+    if ARGV[2] ~= '' then
+        redis.call('SADD', KEYS[4], ARGV[2])
+    end
+end
+return claimed
+"""
+
+
+class BaseJudgeStore:
+    """
+    详情链接判重存储基类,子类实现具体的redis数据结构
+    """
+    name = None
+    chunk_size = 500  # 单次脚本处理的链接数,避免长时间阻塞redis
+    reversible = False  # 是否保存原始链接(可迁移到其他存储)
+
+    def __init__(self, server):
+        self.server = server
+
+    @classmethod
+    def from_settings(cls, server, settings):
+        return cls(server)
+
+    def store_key(self, judge_key):
+        """
+        判重存储实际使用的键,不同存储互不覆盖
+        :param judge_key:
+        :return:
+        """
+        return judge_key
+
+    def keys(self, judge_key):
+        """
+        判重存储使用的全部键
+        :param judge_key:
+        :return: list
+        """
+        return [self.store_key(judge_key)]
+
+    def delete(self, judge_key):
+        """
+        删除判重存储的全部键
+        :param judge_key:
+        :return: int 删除的键数
+        """
+        return self.server.delete(*self.keys(judge_key))
+
+    def claim_and_enqueue(self, judge_key, queue_key, url_tasks, now=None, window=0, sites_key=None, site_id=None):
+        """
+        原子地认领未采集过(或已超过重采周期)的详情链接并存入详情任务队列
+        :param judge_key: 判重键
+        :param queue_key: 详情任务队列键
+        :param url_tasks: [(url, task_str), ...]
+        :param now: 判重时间戳
+        :param window: 重采周期(秒),0为永不重采
+        :param sites_key: 站点集合键,按站点拆分队列时有任务入队则登记站点
+        :param site_id:
+        :return: list 本次认领成功的链接
+        """
+        now = int(now or time.time())
+        site = '' if sites_key is None else str(site_id)
+        sites_key = sites_key or '{0}:sites'.format(queue_key)
+        claimed = []
+        for start in range(0, len(url_tasks), self.chunk_size):
+            chunk = url_tasks[start:start + self.chunk_size]
+            indexes = self._claim_chunk(judge_key, queue_key, chunk, now, int(window or 0), sites_key, site)
+            claimed.extend(chunk[int(index) - 1][0] for index in indexes)
+        return claimed
+
+    def _claim_chunk(self, judge_key, queue_key, url_tasks, now, window, sites_key, site):
+        raise NotImplementedError
+
+    def add(self, judge_key, url_times):
+        """
+        直接写入判重记录(迁移使用)
+        :param judge_key:
+        :param url_times: [(url, timestamp), ...]
+        :return:
+        """
+        raise NotImplementedError
+
+    def add_expires(self, judge_key, url_deadlines):
+        """
+        直接写入重采到期时间(迁移使用),不支持重采周期的存储忽略
+        :param judge_key:
+        :param url_deadlines: [(url, 到期时间戳), ...]
+        :return:
+        """
+
+    def scan_expires(self, judge_key, count=1000):
+        """
+        遍历重采到期时间,不支持重采周期的存储没有记录
+        :param judge_key:
+        :param count:
+        :return: iter (url, 到期时间戳)
+        """
+        return iter(())
+
+    def scan(self, judge_key, count=1000):
+        """
+        遍历判重记录,只有保存原始链接的存储支持
+        :param judge_key:
+        :param count:
+        :return: iter (url, timestamp)
+        """
+        raise NotImplementedError('{0} 不保存原始链接,无法遍历'.format(self.name))
+
+    def count(self, judge_key):
+        raise NotImplementedError
+
+    def false_positive_rate(self, judge_key):
+        """
+        新链接被误判为已采集的概率
+        :param judge_key:
+        :return:
+        """
+        return 0.0
+
+    def stats(self, judge_key):
+        """
+        判重存储的内存与误判统计,内存包括过期zset等附属键
+        :param judge_key:
+        :return: dict
+        """
+        count = self.count(judge_key)
+        memory = sum(self.server.memory_usage(key) or 0 for key in self.keys(judge_key))
+        return {
+            'store': self.name,
+            'key': self.store_key(judge_key),
+            'count': count,
+            'memory_bytes': memory,
+            'bytes_per_million': int(memory / count * 1000000) if count else 0,
+            'false_positive_rate': self.false_positive_rate(judge_key),
+        }
+
+
+class HashJudgeStore(BaseJudgeStore):
+    """
+    基于redis hash的详情链接判重,field为详情链接,value为首次判重时间戳
+    """
+    name = 'hash'
+    reversible = True
+
+    def __init__(self, server, expire_batch=100):
+        super(HashJudgeStore, self).__init__(server)
+        self.expire_batch = expire_batch
+        self._claim_script = server.register_script(CLAIM_AND_ENQUEUE_SCRIPT)
+
+    @classmethod
+    def from_settings(cls, server, settings):
+        return cls(server, settings.getint('REDIS_JUDGE_EXPIRE_BATCH', 100))
+
+    def expire_key(self, judge_key):
+        return '{0}:expire'.format(self.store_key(judge_key))
+
+    def keys(self, judge_key):
+        return [self.store_key(judge_key), self.expire_key(judge_key)]
+
+    def field(self, url):
+        return url
+
+    def _claim_chunk(self, judge_key, queue_key, url_tasks, now, window, sites_key, site):
+        args = [now, window, self.expire_batch, site]
+        for url, task in url_tasks:
+            args.extend((self.field(url), task))
+        keys = [self.store_key(judge_key), queue_key, self.expire_key(judge_key), sites_key]
+        return self._claim_script(keys=keys, args=args)
+
+    def add(self, judge_key, url_times):
+        if url_times:
+            self.server.hset(self.store_key(judge_key),
+                             mapping={self.field(url): ts for url, ts in url_times})
+
+    def add_expires(self, judge_key, url_deadlines):
+        if url_deadlines:
+            self.server.zadd(self.expire_key(judge_key),
+                             mapping={self.field(url): deadline for url, deadline in url_deadlines})
+
+    def scan_expires(self, judge_key, count=1000):
+        return self.server.zscan_iter(self.expire_key(judge_key), count=count)
+
+    def scan(self, judge_key, count=1000):
+        for url, ts in self.server.hscan_iter(self.store_key(judge_key), count=count):
+            yield url, ts
+
+    def count(self, judge_key):
+        return self.server.hlen(self.store_key(judge_key))
+
+
+class FingerprintJudgeStore(HashJudgeStore):
+    """
+    hash中只保存详情链接的8字节指纹,内存约为原始链接的几分之一
+    """
+    name = 'fingerprint'
+    reversible = False
+    digest_size = 8
+
+    def store_key(self, judge_key):
+        return '{0}:fp'.format(judge_key)
+
+    def field(self, url):
+        if isinstance(url, str):
+            url = url.encode('utf-8')
+        return hashlib.blake2b(url, digest_size=self.digest_size).digest()
+
+    def scan(self, judge_key, count=1000):
+        return BaseJudgeStore.scan(self, judge_key, count)
+
+    def false_positive_rate(self, judge_key):
+        # 新链接与已有n个指纹中任意一个碰撞的概率
+        return self.count(judge_key) / float(2 ** (self.digest_size * 8))
+
+
+class BloomJudgeStore(BaseJudgeStore):
+    """
+    基于redis位图的布隆过滤判重,内存固定为 2^bit 位,存在一定误判率
+    位图无法删除单条记录,不支持重采周期
+    """
+    name = 'bloom'
+
+    def __init__(self, server, bit=30, hash_number=6):
+        super(BloomJudgeStore, self).__init__(server)
+        self.bit = bit
+        self.size = 1 << bit
+        self.hash_number = hash_number
+        self._window_warned = False
+        self._claim_script = server.register_script(BLOOM_CLAIM_AND_ENQUEUE_SCRIPT)
+
+    @classmethod
+    def from_settings(cls, server, settings):
+        bit = settings.getint('REDIS_JUDGE_BLOOM_BIT', settings.getint('BLOOMFILTER_BIT', 30))
+        hash_number = settings.getint('REDIS_JUDGE_BLOOM_HASH_NUMBER',
+                                      settings.getint('BLOOMFILTER_HASH_NUMBER', 6))
+        return cls(server, bit, hash_number)
+
+    def store_key(self, judge_key):
+        return '{0}:bloom'.format(judge_key)
+
+    def count_key(self, judge_key):
+        return '{0}:bloom:count'.format(judge_key)
+
+    def keys(self, judge_key):
+        return [self.store_key(judge_key), self.count_key(judge_key)]
+
+    def offsets(self, url):
+        """
+        双重哈希生成k个位偏移
+        :param url:
+        :return:
+        """
+        if isinstance(url, str):
+            url = url.encode('utf-8')
+        digest = hashlib.md5(url).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_number)]
+
+    def _claim_chunk(self, judge_key, queue_key, url_tasks, now, window, sites_key, site):
+        if window and not self._window_warned:
+            self._window_warned = True
+            logger.warning('bloom判重不支持重采周期,RECRAWL_WINDOWS配置将被忽略')
+        args = [self.hash_number, site]
+        for url, task in url_tasks:
+            args.append(task)
+            args.extend(self.offsets(url))
+        keys = [self.store_key(judge_key), queue_key, self.count_key(judge_key), sites_key]
+        return self._claim_script(keys=keys, args=args)
+
+    def add(self, judge_key, url_times):
+        if not url_times:
+            return
+        with self.server.pipeline(transaction=False) as pipe:
+            for url, _ in url_times:
+                for offset in self.offsets(url):
+                    pipe.setbit(self.store_key(judge_key), offset, 1)
+            pipe.incrby(self.count_key(judge_key), len(url_times))
+            pipe.execute()
+
+    def count(self, judge_key):
+        return int(self.server.get(self.count_key(judge_key)) or 0)
+
+    def false_positive_rate(self, judge_key):
+        # (1 - e^(-kn/m))^k
+        n = self.count(judge_key)
+        return (1 - math.exp(-self.hash_number * n / float(self.size))) ** self.hash_number
+
+
+JUDGE_STORES = {
+    HashJudgeStore.name: HashJudgeStore,
+    FingerprintJudgeStore.name: FingerprintJudgeStore,
+    BloomJudgeStore.name: BloomJudgeStore,
+}
+
+
+def load_judge_store(server, settings, name=None):
+    """
+    按配置加载判重存储,支持内置名称(hash/fingerprint/bloom)或类路径
+    :param server:
+    :param settings:
+    :param name:
+    :return:
+    """
+    name = name or settings.get('REDIS_JUDGE_STORE', HashJudgeStore.name)
+    store_cls = JUDGE_STORES.get(name) or load_object(name)
+    return store_cls.from_settings(server, settings)
+
+
+def migrate(src, dst, judge_key, batch_size=1000):
+    """
+    判重记录从一种存储迁移到另一种存储,源存储必须保存原始链接,
+    重采到期时间一并迁移,否则迁移后的链接过了重采周期也不会被清理
+    :param src: 源存储
+    :param dst: 目标存储
+    :param judge_key:
+    :param batch_size:
+    :return: int 迁移的链接数
+    """
+    if not src.reversible:
+        raise ValueError('{0} 不保存原始链接,无法迁移到 {1}'.format(src.name, dst.name))
+    total = _copy(src.scan(judge_key, count=batch_size), lambda batch: dst.add(judge_key, batch), batch_size)
+    _copy(src.scan_expires(judge_key, count=batch_size), lambda batch: dst.add_expires(judge_key, batch), batch_size)
+    return total
+
+
+def _copy(records, write, batch_size):
+    """
+    分批写入
+    :param records: iter
+    :param write: 写入一批记录的函数
+    :param batch_size:
+    :return: int 写入数
+    """
+    total = 0
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            write(batch)
+            total += len(batch)
+            batch = []
+    write(batch)
+    return total + len(batch)
+
+
+def main():
+    from scrapy.utils.project import get_project_settings
+    from scrapy_redis import connection
+
+    parser = argparse.ArgumentParser(description='详情链接判重存储迁移与统计')
+    parser.add_argument('action', choices=['migrate', 'stats'])
+    parser.add_argument('site_id', nargs='+', help='站点id')
+    parser.add_argument('--store', default=None, help='统计使用的存储,默认 REDIS_JUDGE_STORE')
+    parser.add_argument('--src', default=HashJudgeStore.name, help='迁移源存储')
+    parser.add_argument('--dst', default=None, help='迁移目标存储')
+    parser.add_argument('--delete', action='store_true', help='迁移完成后删除源存储')
+    args = parser.parse_args()
+
+    settings = get_project_settings()
+    server = connection.from_settings(settings)
+    judge = settings.get('REDIS_JUDGE_KEY')
+    for site_id in args.site_id:
+        judge_key = judge % {'name': site_id}
+        if args.action == 'stats':
+            print(load_judge_store(server, settings, args.store).stats(judge_key))
+            continue
+        if not args.dst:
+            parser.error('migrate 需要指定 --dst')
+        src = load_judge_store(server, settings, args.src)
+        dst = load_judge_store(server, settings, args.dst)
+        total = migrate(src, dst, judge_key)
+        print('[{0}] {1} -> {2} 迁移 {3} 条'.format(site_id, src.name, dst.name, total))
+        if args.delete:
+            src.delete(judge_key)  # 包括重采周期使用的过期zset等附属键
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 23:20
+# @Author : shl
+# @File : launcher.py
+# @Desc : 单机多进程启动主/子爬虫,崩溃自动重启,统计数据汇总后写入influxdb
+import argparse
+import datetime
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from scrapy.utils.project import get_project_settings
+from twisted.internet import defer, protocol, reactor
+from twisted.internet.task import LoopingCall
+
+from spider.extensions import STATS_MAX_DATAGRAM, InfluxDBExporter
+from spider.metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# 子进程放入独立进程组,终端Ctrl-C只发给launcher,由launcher统一发送一次SIGTERM正常结束子进程
+WORKER_BOOTSTRAP = "import os, sys; os.setpgrp(); from scrapy.cmdline import execute; execute(['scrapy'] + sys.argv[1:])"
+
+
+class WorkerProtocol(protocol.ProcessProtocol):
+    """
+    单个爬虫子进程
+    """
+
+    def __init__(self, launcher, index):
+        self.launcher = launcher
+        self.index = index
+        self.started_at = time.time()
+        self.ended = defer.Deferred()
+
+    def processEnded(self, reason):
+        self.launcher.worker_ended(self, reason.value.exitCode)
+        self.ended.callback(None)
+
+
+class StatsAggregator(protocol.DatagramProtocol):
+    """
+    接收子进程的统计数据: 计数增量求和,当前值各进程取最新值后求和,耗时直方图合并后计算分位数
+    """
+    max_gauges = ('depth',)  # 汇总时取最大值的当前值
+
+    def __init__(self, exporter, host):
+        self.exporter = exporter
+        self.host = host
+        self.decode_errors = 0  # 无法解析(被截断或格式错误)的数据报数
+        self.deltas = defaultdict(lambda: defaultdict(int))  # spider_name -> 字段 -> 增量
+        self.gauges = defaultdict(dict)  # spider_name -> worker -> 当前值
+        self.histograms = {}  # (spider_name, stage, tags) -> LatencyHistogram
+
+    def datagramReceived(self, data, addr):
+        try:
+            message = json.loads(data.decode('utf-8'))
+        except ValueError as e:
+            self.decode_errors += 1
+            logger.warning('统计数据解析失败({0}字节,累计{1}次)：{2}'.format(len(data), self.decode_errors, str(e)))
+            return
+        if 'point' in message:
+            point = message['point']
+            point.setdefault('tags', {}).update(host=self.host, worker=message.get('worker') or '')
+            self.exporter.add(point)
+            return
+        spider_name = message.get('spider_name')
+        for key, value in message.get('deltas', {}).items():
+            self.deltas[spider_name][key] += value
+        if 'gauges' in message:
+            self.gauges[spider_name][message.get('worker')] = message['gauges']
+        for stage, tags, state in message.get('latency', []):
+            key = (spider_name, stage, tuple(sorted(tags.items())))
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.merge(state)
+
+    def export(self):
+        """
+        汇总本周期数据写入influxdb
+        :return:
+        """
+        point_time = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        deltas, self.deltas = self.deltas, defaultdict(lambda: defaultdict(int))
+        histograms, self.histograms = self.histograms, {}
+        for spider_name in set(deltas) | set(self.gauges):
+            fields = dict(deltas.get(spider_name, {}))
+            workers = self.gauges.get(spider_name, {})
+            for gauges in workers.values():
+                for key, value in gauges.items():
+                    if key in self.max_gauges:
+                        fields[key] = max(fields.get(key, 0), value)
+                    else:
+                        fields[key] = fields.get(key, 0) + value
+            fields['workers'] = len(workers)
+            fields['spider_name'] = spider_name
+            self.exporter.add({
+                "measurement": "newspider",
+                "time": point_time,
+                "tags": {'spider_name': spider_name, 'host': self.host},
+                "fields": fields
+            })
+        for (spider_name, stage, tags), histogram in histograms.items():
+            point_tags = {'spider_name': spider_name, 'stage': stage, 'host': self.host}
+            point_tags.update((key, str(value)) for key, value in tags)
+            self.exporter.add({
+                "measurement": "newspider",
+                "time": point_time,
+                "tags": point_tags,
+                "fields": histogram.fields()
+            })
+
+    def worker_ended(self, worker_id):
+        for workers in self.gauges.values():
+            workers.pop(worker_id, None)
+
+
+class Launcher:
+    """
+    启动N个主/子爬虫进程,每个进程分配固定的WORKER_ID(可靠队列与统计使用),
+    进程退出后按退避时间重启,运行时间过短的进程退避时间翻倍
+    """
+
+    def __init__(self, settings, workers, master=0, spider_name='spider', extra_settings=None):
+        self.settings = settings
+        self.workers = workers
+        self.master = master
+        self.spider_name = spider_name
+        self.extra_settings = extra_settings or []
+        self.host = socket.gethostname()
+        self.restart_delay = settings.getfloat('LAUNCHER_RESTART_DELAY', 1)
+        self.max_restart_delay = settings.getfloat('LAUNCHER_MAX_RESTART_DELAY', 60)
+        self.min_uptime = settings.getfloat('LAUNCHER_MIN_UPTIME', 30)
+        self.stop_timeout = settings.getfloat('LAUNCHER_STOP_TIMEOUT', 60)
+        self.running = {}  # index -> (WorkerProtocol, IProcessTransport)
+        self.delays = defaultdict(lambda: self.restart_delay)
+        self.stopping = False
+        self.socket_path = os.path.join(tempfile.gettempdir(), 'spider-launcher-{0}.sock'.format(os.getpid()))
+        self.aggregator = None
+        self.exporter = None
+        self.export_task = None
+
+    def worker_id(self, index):
+        role = 'master' if self.master else 'slave'
+        return '{0}:{1}:{2}{3}'.format(self.host, os.getpid(), role, index)
+
+    def start(self):
+        self.exporter = InfluxDBExporter.from_settings(self.settings)
+        self.exporter.start()
+        self.aggregator = StatsAggregator(self.exporter, self.host)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        reactor.listenUNIXDatagram(self.socket_path, self.aggregator, maxPacketSize=STATS_MAX_DATAGRAM)
+        self.export_task = LoopingCall(self.aggregator.export)
+        self.export_task.start(self.settings.getfloat('INTERVAL', 60), now=False)
+        for index in range(self.workers):
+            self.spawn(index)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+    def spawn(self, index):
+        args = [sys.executable, '-c', WORKER_BOOTSTRAP, 'crawl', self.spider_name,
+                '-a', 'master={0}'.format(self.master),
+                '-s', 'WORKER_ID={0}'.format(self.worker_id(index)),
+                '-s', 'STATS_AGGREGATE_SOCKET={0}'.format(self.socket_path)]
+        for item in self.extra_settings:
+            args.extend(('-s', item))
+        worker = WorkerProtocol(self, index)
+        transport = reactor.spawnProcess(worker, sys.executable, args, env=os.environ.copy(), path=os.getcwd(),
+                                         childFDs={0: 'w', 1: 1, 2: 2})
+        self.running[index] = (worker, transport)
+        logger.info('爬虫进程[{0}]已启动,pid：{1}'.format(self.worker_id(index), transport.pid))
+
+    def worker_ended(self, worker, exit_code):
+        index = worker.index
+        self.running.pop(index, None)
+        self.aggregator.worker_ended(self.worker_id(index))
+        if self.stopping:
+            return
+        if time.time() - worker.started_at < self.min_uptime:
+            delay = self.delays[index]
+            self.delays[index] = min(delay * 2, self.max_restart_delay)
+        else:
+            delay = self.delays[index] = self.restart_delay
+        logger.warning('爬虫进程[{0}]已退出(exit code {1}),{2}秒后重启'.format(self.worker_id(index), exit_code, delay))
+        reactor.callLater(delay, self._restart, index)
+
+    def _restart(self, index):
+        if not self.stopping and index not in self.running:
+            self.spawn(index)
+
+    def stop(self):
+        """
+        通知子进程正常结束(SIGTERM),超时未退出的强制结束,最后写入剩余统计数据
+        :return: Deferred
+        """
+        self.stopping = True
+        if self.export_task.running:
+            self.export_task.stop()
+        waits = []
+        for worker, transport in list(self.running.values()):
+            waits.append(worker.ended)
+            try:
+                transport.signalProcess('TERM')
+            except Exception:
+                pass
+        kill_call = reactor.callLater(self.stop_timeout, self._kill)
+        d = defer.DeferredList(waits)
+
+        def _stopped(_):
+            if kill_call.active():
+                kill_call.cancel()
+            self.aggregator.export()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            return self.exporter.close()
+        d.addCallback(_stopped)
+        return d
+
+    def _kill(self):
+        for worker, transport in list(self.running.values()):
+            logger.warning('爬虫进程[{0}]未按时退出,强制结束'.format(self.worker_id(worker.index)))
+            try:
+                transport.signalProcess('KILL')
+            except Exception:
+                pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='单机多进程启动主/子爬虫')
+    parser.add_argument('-n', '--workers', type=int, default=0, help='进程数,默认 LAUNCHER_WORKERS 或cpu核数')
+    parser.add_argument('--master', type=int, default=0, choices=(0, 1), help='1:主爬虫 0:子爬虫')
+    parser.add_argument('--spider', default='spider')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE', help='传给爬虫进程的配置')
+    args = parser.parse_args(argv)
+
+    settings = get_project_settings()
+    logging.basicConfig(level=settings.get('LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s [%(name)s] %(levelname)s: %(message)s')
+    workers = args.workers or settings.getint('LAUNCHER_WORKERS') or os.cpu_count() or 1
+    launcher = Launcher(settings, workers, args.master, args.spider, args.set)
+    reactor.callWhenRunning(launcher.start)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
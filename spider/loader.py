@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 15:02
+# @Author : shl
+# @File : loader.py
+# @Desc : 模板脚本加载
+import hashlib
+import importlib
+import logging
+import os
+import threading
+import time
+
+from scrapy_redis.utils import bytes_to_str
+
+logger = logging.getLogger(__name__)
+
+
+class ScriptEntry:
+    """
+    已加载的模板脚本
+    """
+    __slots__ = ('module', 'script_class', 'mtime', 'digest', 'version', 'checked_at')
+
+    def __init__(self, module, script_class, mtime, digest, version):
+        self.module = module
+        self.script_class = script_class
+        self.mtime = mtime
+        self.digest = digest
+        self.version = version
+        self.checked_at = time.time()
+
+
+class ScriptRegistry:
+    """
+    模板脚本缓存,按 (site_id, template_id) 缓存脚本类
+    脚本文件修改时间与内容摘要变化,或redis中模板版本号变化时才重新加载
+    """
+    class_name = 'Script'
+
+    def __init__(self, package='spider.script', check_interval=5, server=None, version_key=None):
+        self.package = package
+        self.check_interval = check_interval  # 检查脚本文件是否变化的最小间隔(秒)
+        self.server = server
+        self.version_key = version_key  # redis模板版本号hash, field为 站点id_模板id
+        self.versions = {}
+        self.cache = {}
+        self._lock = threading.RLock()  # 解析线程池中并发获取脚本时,同一脚本只加载一次
+
+    @classmethod
+    def from_settings(cls, settings, server=None):
+        return cls(
+            package=settings.get('SCRIPT_PACKAGE', 'spider.script'),
+            check_interval=settings.getfloat('SCRIPT_CHECK_INTERVAL', 5),
+            server=server,
+            version_key=settings.get('SCRIPT_VERSION_KEY'),
+        )
+
+    @staticmethod
+    def script_name(site_id, template_id):
+        return '{0}_{1}'.format(site_id, template_id)
+
+    def module_path(self, site_id, template_id):
+        return '{0}.s{1}'.format(self.package, self.script_name(site_id, template_id))
+
+    def get(self, site_id, template_id):
+        """
+        获取模板脚本类
+        :param site_id: 网站配置的站点id
+        :param template_id: 网站配置的站点采集数据类型id
+        :return:
+        """
+        name = self.script_name(site_id, template_id)
+        entry = self.cache.get(name)
+        now = time.time()
+        if entry is not None and now - entry.checked_at < self.check_interval:
+            return entry.script_class
+        with self._lock:
+            entry = self.cache.get(name)
+            if entry is None:
+                return self._load(name, site_id, template_id).script_class
+            if now - entry.checked_at >= self.check_interval:
+                entry.checked_at = now
+                if self._changed(name, entry):
+                    entry = self._load(name, site_id, template_id, entry.module)
+            return entry.script_class
+
+    def _load(self, name, site_id, template_id, module=None):
+        """
+        导入(或重新加载)模板脚本
+        :param name:
+        :param site_id:
+        :param template_id:
+        :param module: 已导入的模块,传入时重新加载
+        :return: ScriptEntry
+        """
+        if module is None:
+            module = importlib.import_module(self.module_path(site_id, template_id))
+        else:
+            module = importlib.reload(module)
+            logger.info('模板脚本[{0}]已重新加载'.format(name))
+        mtime, digest = self._file_info(module)
+        entry = ScriptEntry(module, getattr(module, self.class_name), mtime, digest, self.versions.get(name))
+        self.cache[name] = entry
+        return entry
+
+    @staticmethod
+    def _file_info(module, mtime=None):
+        path = getattr(module, '__file__', None)
+        if not path or not os.path.exists(path):
+            return None, None
+        if mtime is None:
+            mtime = os.stat(path).st_mtime
+        with open(path, 'rb') as f:
+            digest = hashlib.md5(f.read()).hexdigest()
+        return mtime, digest
+
+    def _changed(self, name, entry):
+        """
+        模板脚本是否变化: 版本号变化,或修改时间变化且内容摘要变化
+        :param name:
+        :param entry:
+        :return:
+        """
+        if self.versions.get(name) != entry.version:
+            return True
+        path = getattr(entry.module, '__file__', None)
+        if not path or not os.path.exists(path):
+            return False
+        mtime = os.stat(path).st_mtime
+        if mtime == entry.mtime:
+            return False
+        _, digest = self._file_info(entry.module, mtime)
+        if digest != entry.digest:
+            return True
+        entry.mtime = mtime
+        return False
+
+    def refresh_versions(self):
+        """
+        从redis读取模板版本号(在线程中执行)
+        :return:
+        """
+        if self.server is None or not self.version_key:
+            return
+        versions = self.server.hgetall(self.version_key)
+        self.versions = {bytes_to_str(k): bytes_to_str(v) for k, v in versions.items()}
+
+    def preload(self, names):
+        """
+        预加载模板脚本
+        :param names: ['站点id_模板id', ...]
+        :return:
+        """
+        for name in names:
+            site_id, _, template_id = str(name).partition('_')
+            try:
+                self.get(site_id, template_id)
+            except Exception as e:
+                logger.error('模板脚本[{0}]预加载失败：{1}'.format(name, str(e)))
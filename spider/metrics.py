@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 20:30
+# @Author : shl
+# @File : metrics.py
+# @Desc : 关键环节耗时统计
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+from scrapy import signals
+
+# 对数分桶上界(毫秒),相邻桶相差约19%,覆盖0.1ms到约15分钟
+BUCKET_BOUNDS = [0.1 * 2 ** (i / 4.0) for i in range(93)]
+
+
+class LatencyHistogram:
+    """
+    固定对数分桶的耗时直方图,记录为O(1),分位数误差不超过一个桶宽
+    """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, ms):
+        self.counts[bisect_left(BUCKET_BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, q):
+        """
+        分位数(取所在桶的上界)
+        :param q: 0~1
+        :return: 毫秒
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(BUCKET_BOUNDS[index], self.max) if index < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def state(self):
+        """
+        可序列化的直方图数据(只保留非空桶),用于多进程汇总
+        :return: dict
+        """
+        return {
+            'buckets': {index: count for index, count in enumerate(self.counts) if count},
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+        }
+
+    def merge(self, state):
+        """
+        合并其他进程的直方图数据
+        :param state: state() 的返回值(json传输后桶序号为字符串)
+        :return:
+        """
+        for index, count in state['buckets'].items():
+            self.counts[int(index)] += count
+        self.count += state['count']
+        self.total += state['total']
+        self.max = max(self.max, state['max'])
+
+    def fields(self):
+        return {
+            'count': self.count,
+            'avg': round(self.total / self.count, 3) if self.count else 0.0,
+            'p50': round(self.percentile(0.5), 3),
+            'p95': round(self.percentile(0.95), 3),
+            'p99': round(self.percentile(0.99), 3),
+            'max': round(self.max, 3),
+        }
+
+
+class LatencyRecorder:
+    """
+    按 (环节, 标签) 记录耗时直方图,每个crawler共用一个,按统计间隔导出后清零
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.histograms = {}
+        self._lock = Lock()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        recorder = getattr(crawler, 'latency_recorder', None)
+        if recorder is None:
+            recorder = cls(crawler.settings.getbool('LATENCY_METRICS_ENABLED', True))
+            crawler.latency_recorder = recorder
+            crawler.signals.connect(recorder.response_received, signal=signals.response_received)
+        return recorder
+
+    def record(self, stage, ms, **tags):
+        """
+        记录一次耗时
+        :param stage: 环节,如 download / parse_list / filter_items_url / insert_data
+        :param ms: 耗时(毫秒)
+        :param tags: 标签,如 site_id / template_id
+        :return:
+        """
+        if not self.enabled:
+            return
+        key = (stage, tuple(sorted(tags.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.record(ms)
+
+    @contextmanager
+    def timer(self, stage, **tags):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.time() - start) * 1000, **tags)
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is None:
+            return
+        task = request.meta.get('task', {})
+        self.record('download', latency * 1000,
+                    site_id=task.get('site_id'), template_id=task.get('template_id'))
+
+    def drain(self):
+        """
+        取出全部直方图并清零
+        :return: [(stage, tags, LatencyHistogram), ...]
+        """
+        with self._lock:
+            histograms, self.histograms = self.histograms, {}
+        return [(stage, dict(tags), histogram) for (stage, tags), histogram in histograms.items()]
+
+    def export(self):
+        """
+        导出并清零
+        :return: [(stage, tags, fields), ...]
+        """
+        return [(stage, tags, histogram.fields()) for stage, tags, histogram in self.drain()]
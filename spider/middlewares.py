@@ -2,16 +2,25 @@
 #
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
+import json
 import random
-import time
+import re
 
 from fake_useragent import UserAgent
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import TextResponse
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy_redis.utils import bytes_to_str
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
 
-# useful for handling different item types with a single interface
-from itemadapter import is_item, ItemAdapter
-from scrapy.crawler import logger
-from scrapy_redis import connection
+from spider.connection import get_redis
+from spider.default import LIST_TASK
+from spider.downloader import park
+from spider.proxy import ProxyPool
+from spider.ratelimit import RateLimiter
+from spider.throttle import AdaptiveThrottle, ThrottleSync
 
 
 class SpiderSpiderMiddleware:
@@ -133,41 +142,335 @@ class SpiderUserAgentMiddleware(SpiderDownloaderMiddleware):
 
 
 class SpiderProxyMiddleware(SpiderDownloaderMiddleware):
+    """
+    代理中间件,根据响应状态、耗时和异常反馈代理质量,封禁或失败的请求换代理重试
+    优先级需大于 RetryMiddleware(550),保证下载异常先经过本中间件,
+    并与 RedirectMiddleware(600) 错开,两者顺序确定
+    """
 
-    def __init__(self, server, settings):
+    def __init__(self, server, settings, stats=None):
         self.server = server
         self.settings = settings
+        self.stats = stats
+        self.ban_codes = set(settings.getlist('PROXY_BAN_CODES', [403, 429]))
+        self.retry_times = settings.getint('PROXY_RETRY_TIMES', 3)
+        self.pool = ProxyPool(
+            server, settings.get('PROXY_REDIS_KEY'),
+            batch_size=settings.getint('PROXY_BATCH_SIZE', 20),
+            max_uses=settings.getint('PROXY_MAX_USES', 5),
+            low_water=settings.getint('PROXY_LOW_WATER', 5),
+            retry_delay=settings.getint('PROXY_RETRY_DELAY', 10),
+            max_failures=settings.getint('PROXY_MAX_FAILURES', 3),
+            failure_penalty=settings.getfloat('PROXY_FAILURE_PENALTY', 4.0),
+        )
 
     @classmethod
     def from_crawler(cls, crawler):
         settings = crawler.settings
-        server = connection.from_settings(settings)
+        server = get_redis(crawler)
 
-        s = cls(server, settings)
+        s = cls(server, settings, crawler.stats)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
-    @staticmethod
-    def spider_closed(spider):
+    def spider_closed(self, spider):
+        self.pool.close()
         spider.logger.info('SpiderProxyMiddleware is closing')
 
     def process_request(self, request, spider):
         if self.settings.get('IS_PROXY'):
-            proxy_ip = self._add_proxy()
-            request.meta['proxy'] = proxy_ip
+            d = self.pool.get()
+            d.addCallback(self._add_proxy, request)
+            return d
         return None
 
-    def _add_proxy(self):
-        while True:
-            ip_str = self.server.lpop(self.settings.get('PROXY_REDIS_KEY'))
-            time_sleep = 10
-            if ip_str:
-                break
-            logger.info("未获取到代理ip,休眠{0}秒，等待下次获取~~~".format(time_sleep))
-            time.sleep(time_sleep)
-        proxy_ip = 'http://{0}'.format(ip_str)
-        return proxy_ip
+    @staticmethod
+    def _add_proxy(proxy_ip, request):
+        request.meta['proxy'] = proxy_ip
+        return None
+
+    def process_response(self, request, response, spider):
+        proxy = request.meta.get('proxy')
+        if not proxy:
+            return response
+        if response.status in self.ban_codes:
+            self._report_failure(proxy, ban=True)
+            return self._retry(request, 'status_{0}'.format(response.status), spider) or response
+        self.pool.report_success(proxy, request.meta.get('download_latency'))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        proxy = request.meta.get('proxy')
+        if not proxy:
+            return None
+        self._report_failure(proxy)
+        return self._retry(request, exception.__class__.__name__, spider)
+
+    def _report_failure(self, proxy, ban=False):
+        if self.stats:
+            self.stats.inc_value('proxy/ban' if ban else 'proxy/failure')
+        if self.pool.report_failure(proxy, ban) and self.stats:
+            self.stats.inc_value('proxy/evicted')
+
+    def _retry(self, request, reason, spider):
+        """
+        换一个代理重试
+        :param request:
+        :param reason:
+        :param spider:
+        :return: Request 或 None(超过重试次数)
+        """
+        retry_times = request.meta.get('proxy_retry_times', 0) + 1
+        if retry_times > self.retry_times:
+            spider.logger.info('代理重试次数已用完[{0}]：{1}'.format(reason, request.url))
+            return None
+        retry_request = request.copy()
+        retry_request.meta['proxy_retry_times'] = retry_times
+        retry_request.meta.pop('proxy', None)
+        retry_request.dont_filter = True
+        if self.stats:
+            self.stats.inc_value('proxy/retry/{0}'.format(reason))
+        return retry_request
 
     def spider_opened(self, spider):
+        if self.settings.get('IS_PROXY'):
+            self.pool.refill()
         spider.logger.info('SpiderProxyMiddleware is starting')
+
+
+class SpiderThrottleMiddleware(SpiderDownloaderMiddleware):
+    """
+    按域名的自适应并发控制,替代按下载槽位的AutoThrottle,封禁与耗时按 (域名, 代理) 统计
+    优先级需大于 SpiderProxyMiddleware(590),在分配代理之后占用并发,并先于代理中间件处理响应
+    等待并发的请求已进入下载器,每个域名最多 THROTTLE_MAX_PARKED 个等待请求停靠(不占用全局并发,
+    需配合 ParkingDownloader),超过后的等待请求占用全局并发,避免慢站点的等待请求占满并发
+    """
+    captcha_scan_bytes = 65536  # 只在响应开头查找验证码特征
+
+    def __init__(self, server, settings, stats=None, crawler=None):
+        self.server = server
+        self.settings = settings
+        self.stats = stats
+        self.crawler = crawler
+        self.max_parked = settings.getint('THROTTLE_MAX_PARKED', 16)
+        self.ban_codes = set(settings.getlist('THROTTLE_BAN_CODES', [403, 429]))
+        patterns = settings.getlist('THROTTLE_CAPTCHA_PATTERNS')
+        self.captcha = re.compile('|'.join(re.escape(p) for p in patterns).encode('utf-8'), re.I) if patterns else None
+        self.throttle = AdaptiveThrottle(
+            start=settings.getfloat('THROTTLE_START_CONCURRENCY', 4),
+            minimum=settings.getfloat('THROTTLE_MIN_CONCURRENCY', 1),
+            maximum=settings.getfloat('THROTTLE_MAX_CONCURRENCY', 32),
+            increase=settings.getfloat('THROTTLE_INCREASE', 1.0),
+            decrease=settings.getfloat('THROTTLE_DECREASE', 0.5),
+            latency_factor=settings.getfloat('THROTTLE_LATENCY_FACTOR', 3.0),
+            idle_timeout=settings.getint('THROTTLE_IDLE_TIMEOUT', 300),
+        )
+        self.sync = ThrottleSync(server, settings.get('THROTTLE_REDIS_KEY', 'spider:throttle'), self.throttle)
+        self.sync_task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('THROTTLE_ENABLED'):
+            raise NotConfigured
+        server = get_redis(crawler)
+
+        s = cls(server, settings, crawler.stats, crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        self.sync_task = LoopingCall(self.sync.sync)
+        self.sync_task.start(self.settings.getfloat('THROTTLE_SYNC_INTERVAL', 10))
+        spider.logger.info('SpiderThrottleMiddleware is starting')
+
+    def spider_closed(self, spider):
+        if self.sync_task and self.sync_task.running:
+            self.sync_task.stop()
+        spider.logger.info('SpiderThrottleMiddleware is closing')
+        return self.sync.sync()
+
+    @staticmethod
+    def throttle_key(request):
+        return urlparse_cached(request).hostname or '', request.meta.get('proxy') or ''
+
+    def process_request(self, request, spider):
+        key = self.throttle_key(request)
+        d = self.throttle.acquire(key)
+        if not d.called and self.crawler is not None and len(self.throttle.domain(key[0]).waiters) <= self.max_parked:
+            park(self.crawler, d)
+        d.addCallback(self._acquired, request, key)
+        return d
+
+    @staticmethod
+    def _acquired(_, request, key):
+        request.meta['throttle_key'] = key
+        return None
+
+    def process_response(self, request, response, spider):
+        key = request.meta.pop('throttle_key', None)
+        if key is None:
+            return response
+        self.throttle.release(key)
+        if response.status in self.ban_codes:
+            self._report_failure(key, 'status_{0}'.format(response.status))
+        elif self.captcha is not None and isinstance(response, TextResponse) \
+                and self.captcha.search(response.body, 0, self.captcha_scan_bytes):
+            self._report_failure(key, 'captcha')
+        else:
+            self.throttle.report_success(key, request.meta.get('download_latency'))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        key = request.meta.pop('throttle_key', None)
+        if key is not None:
+            self.throttle.release(key)
+            self._report_failure(key, exception.__class__.__name__)
+        return None
+
+    def _report_failure(self, key, reason):
+        decreased = self.throttle.report_failure(key)
+        if self.stats:
+            self.stats.inc_value('throttle/failure/{0}'.format(reason))
+            if decreased:
+                self.stats.inc_value('throttle/decrease')
+
+
+class SpiderRateLimitMiddleware(SpiderDownloaderMiddleware):
+    """
+    按域名或站点的全局限速,令牌桶保存在redis中,多个子爬虫合计的请求速率不超过配置值
+    优先级在 SpiderProxyMiddleware 与 SpiderThrottleMiddleware 之间,等待令牌时还未占用域名的并发,
+    但请求已进入下载器,每个限速键最多 RATE_LIMIT_MAX_PARKED 个等待请求停靠(不占用全局并发,需配合 ParkingDownloader),
+    超过后的等待请求占用全局并发
+    """
+
+    def __init__(self, server, settings, crawler=None):
+        self.server = server
+        self.settings = settings
+        self.crawler = crawler
+        self.max_parked = settings.getint('RATE_LIMIT_MAX_PARKED', 16)
+        self.key_by = settings.get('RATE_LIMIT_BY', 'domain')  # domain / site
+        self.limiter = RateLimiter(
+            server, settings.get('RATE_LIMIT_REDIS_KEY', 'spider:ratelimit:%(name)s'),
+            rates=settings.getdict('RATE_LIMITS'),
+            default_rate=settings.getfloat('RATE_LIMIT_DEFAULT', 0),
+            burst=settings.getfloat('RATE_LIMIT_BURST', 1.0),
+            batch_size=settings.getint('RATE_LIMIT_BATCH', 5),
+            token_ttl=settings.getfloat('RATE_LIMIT_TOKEN_TTL', 1.0),
+        )
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getdict('RATE_LIMITS') and not settings.getfloat('RATE_LIMIT_DEFAULT'):
+            raise NotConfigured
+        server = get_redis(crawler)
+
+        s = cls(server, settings, crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_closed(self, spider):
+        self.limiter.close()
+        spider.logger.info('SpiderRateLimitMiddleware is closing')
+
+    def limit_name(self, request):
+        if self.key_by == 'site':
+            return request.meta.get('task', {}).get('site_id')
+        return urlparse_cached(request).hostname
+
+    def process_request(self, request, spider):
+        name = self.limit_name(request)
+        bucket = self.limiter.bucket(name) if name is not None else None
+        if bucket is None:
+            return None
+        d = bucket.acquire()
+        if not d.called and self.crawler is not None and len(bucket.waiters) <= self.max_parked:
+            park(self.crawler, d)
+        d.addCallback(lambda _: None)
+        return d
+
+
+class SpiderConditionalMiddleware(SpiderDownloaderMiddleware):
+    """
+    主爬虫列表页条件请求: 带上次响应的 ETag / Last-Modified 请求,列表页未变化时站点返回304,解析前直接结束
+    新的校验信息放入 meta['list_cache'],由 SpiderRedisPipeline 在翻页与详情任务入队后保存
+    """
+
+    def __init__(self, server, validators_key, digests_key=None, stats=None):
+        self.server = server
+        self.validators_key = validators_key  # 列表页校验信息hash, field为列表页链接
+        self.digests_key = digests_key  # 列表页详情链接摘要hash,未开启摘要检查时为None
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('LIST_CONDITIONAL_ENABLED'):
+            raise NotConfigured
+        server = get_redis(crawler)
+        name = {'name': crawler.spidercls.name}
+        validators_key = settings.get('LIST_VALIDATORS_KEY', '%(name)s:list_validators') % name
+        digests_key = None
+        if settings.getbool('LIST_DIGEST_ENABLED'):
+            digests_key = settings.get('LIST_DIGESTS_KEY', '%(name)s:list_digests') % name
+
+        s = cls(server, validators_key, digests_key, crawler.stats)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def process_request(self, request, spider):
+        if not spider.is_master or 'list_cache' in request.meta:
+            return None
+        if request.meta.get('task', {}).get('task_type') != LIST_TASK:
+            return None
+        d = deferToThread(self._lookup, request.url)
+        d.addCallback(self._conditional, request)
+        d.addErrback(self._lookup_failed, request, spider)
+        return d
+
+    def _lookup(self, url):
+        with self.server.pipeline(transaction=False) as pipe:
+            pipe.hget(self.validators_key, url)
+            if self.digests_key:
+                pipe.hget(self.digests_key, url)
+            result = pipe.execute()
+        return result[0], result[1] if self.digests_key else None
+
+    @staticmethod
+    def _conditional(result, request):
+        validators, digest = result
+        request.meta['list_cache'] = {'digest': bytes_to_str(digest) if digest else None}
+        if validators:
+            validators = json.loads(bytes_to_str(validators))
+            if validators.get('etag'):
+                request.headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                request.headers['If-Modified-Since'] = validators['last_modified']
+            request.meta['handle_httpstatus_list'] = list(request.meta.get('handle_httpstatus_list', [])) + [304]
+        return None
+
+    @staticmethod
+    def _lookup_failed(failure, request, spider):
+        spider.logger.error('列表页校验信息获取失败[{0}]：{1}'.format(request.url, failure.getErrorMessage()))
+        request.meta['list_cache'] = {'digest': None}
+        return None
+
+    def process_response(self, request, response, spider):
+        cache = request.meta.get('list_cache')
+        if cache is None:
+            return response
+        if response.status == 304:
+            if self.stats:
+                self.stats.inc_value('list/not_modified')
+        elif response.status == 200:
+            validators = {
+                'etag': bytes_to_str(response.headers.get('ETag') or b''),
+                'last_modified': bytes_to_str(response.headers.get('Last-Modified') or b''),
+            }
+            if validators['etag'] or validators['last_modified']:
+                cache['validators'] = validators
+        return response
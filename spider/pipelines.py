@@ -6,22 +6,46 @@
 import copy
 import hashlib
 import json
+import logging
 import time
+from collections import defaultdict
 
 import pymongo as pymongo
-from scrapy_redis import connection
+from pymongo import UpdateOne
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
 from twisted.internet.threads import deferToThread
 
-from spider.default import DETAIL_TASK, LIST_TASK
+from spider.connection import get_redis
+from spider.default import DEEP_LEVEL, DETAIL_TASK, LIST_TASK
+from spider.judge import load_judge_store
+from spider.metrics import LatencyRecorder
+from spider.queue import FairQueue
+
+logger = logging.getLogger(__name__)
 
 
 class SpiderPipeline:
     def process_item(self, item, spider):
         return item
 
+    @staticmethod
+    def item_task(item):
+        """
+        item所属请求的任务信息
+        :param item: TaskItem
+        :return:
+        """
+        return item.task
+
 
 class SpiderRedisPipeline(SpiderPipeline):
-    def __init__(self, server, slave_key, master_key, judge_key, scan_page):
+    pagination_fields = ('depth', 'low_pages', 'watermark')  # 列表任务中随翻页变化的字段
+
+    def __init__(self, server, slave_key, master_key, judge_key, scan_page, judge_batch=True, judge_store=None,
+                 recrawl_window=0, recrawl_windows=None, fair_queue=False, site_weights=None,
+                 next_page_priority=False, validators_key=None, digests_key=None, pagination_policy=None,
+                 pagination_policies=None, watermark_key=None):
         super(SpiderRedisPipeline, self).__init__()
         self.redis_server = server
         self.scan_page = False
@@ -29,6 +53,21 @@ class SpiderRedisPipeline(SpiderPipeline):
         self._master = master_key
         self._judge = judge_key
         self.scan_page = scan_page
+        self.judge_batch = judge_batch
+        self.judge_store = judge_store
+        self.recrawl_window = recrawl_window
+        self.recrawl_windows = recrawl_windows or {}
+        self.fair_queue = fair_queue  # 按站点拆分任务队列
+        self.site_weights = site_weights or {}
+        self.next_page_priority = next_page_priority  # 翻页任务放入队首
+        self.validators_key = validators_key  # 列表页条件请求校验信息hash
+        self.digests_key = digests_key  # 列表页详情链接摘要hash,为None时不检查
+        self.pagination_policy = pagination_policy or {}  # 默认翻页停止策略
+        self.pagination_policies = pagination_policies or {}  # 按站点配置的翻页停止策略
+        self.watermark_key = watermark_key  # 入口列表水位线hash, field为入口列表页链接
+        self.codec = None
+        self.latency = LatencyRecorder(enabled=False)
+        self._queues = {}
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -37,23 +76,50 @@ class SpiderRedisPipeline(SpiderPipeline):
         master_key = settings.get('REDIS_START_URLS_MASTER_KEY')
         judge_key = settings.get('REDIS_JUDGE_KEY')
         scan_page = settings.get('SCAN_PAGE')
-        server = connection.from_settings(settings)
-        s = cls(server, slave_key, master_key, judge_key, scan_page)
+        judge_batch = settings.getbool('REDIS_JUDGE_BATCH', True)
+        server = get_redis(crawler)
+        judge_store = load_judge_store(server, settings)
+        recrawl_window = settings.getint('RECRAWL_WINDOW', 0)
+        recrawl_windows = settings.getdict('RECRAWL_WINDOWS')
+        fair_queue = settings.getbool('REDIS_FAIR_QUEUE')
+        site_weights = settings.getdict('SITE_WEIGHTS')
+        next_page_priority = settings.getbool('NEXT_PAGE_PRIORITY')
+        name = {'name': crawler.spidercls.name}
+        validators_key = settings.get('LIST_VALIDATORS_KEY', '%(name)s:list_validators') % name
+        digests_key = None
+        if settings.getbool('LIST_DIGEST_ENABLED'):
+            digests_key = settings.get('LIST_DIGESTS_KEY', '%(name)s:list_digests') % name
+        pagination_policy = settings.getdict('PAGINATION_POLICY')
+        pagination_policies = settings.getdict('PAGINATION_POLICIES')
+        watermark_key = settings.get('PAGINATION_WATERMARK_KEY', '%(name)s:list_watermark') % name
+        s = cls(server, slave_key, master_key, judge_key, scan_page, judge_batch, judge_store,
+                recrawl_window, recrawl_windows, fair_queue, site_weights, next_page_priority,
+                validators_key, digests_key, pagination_policy, pagination_policies, watermark_key)
+        s.latency = LatencyRecorder.from_crawler(crawler)
         return s
 
-    @staticmethod
-    def open_spider(spider):
+    def open_spider(self, spider):
+        self.codec = spider.codec  # 与爬虫共用任务编码,任务头缓存只保留一份
         spider.logger.info('SpiderRedisPipeline is starting')
 
     def close_spider(self, spider):
-        self.redis_server.close()
-        spider.logger.info('SpiderRedisPipeline is closing')
+        spider.logger.info('SpiderRedisPipeline is closing')  # redis连接与爬虫共用,由get_redis在引擎停止后断开
 
     def process_item(self, item, spider):
         if spider.is_master:  # 主爬虫用于详情判重以及翻页
-            return deferToThread(self.pro_items, item, spider)
+            d = deferToThread(self.pro_items, item, spider)
+            d.addCallback(self._ack_item, item, spider)
+            return d
         return item
 
+    @staticmethod
+    def _ack_item(result, item, spider):
+        if result is not None:  # 翻页与详情任务已入队
+            spider.ack_task(item.context.member)
+        else:  # pro_items出错已记录日志,任务移入死信队列
+            spider.fail_task(item.context.member, 'pipeline')
+        return result
+
     def pro_items(self, item, spider):
         """
         对列表结果数据的解析保存
@@ -62,22 +128,134 @@ class SpiderRedisPipeline(SpiderPipeline):
         :return:
         """
         try:
-            task_item = spider._task
+            task_item = self.item_task(item)
             detail_task_info = copy.deepcopy(task_item)  # 拷贝任务头信息
+            for field in self.pagination_fields:  # 翻页状态只属于列表任务
+                detail_task_info.pop(field, None)
             list_task_info = copy.deepcopy(task_item)  # 拷贝任务头信息
             list_item = item
             detail_key, master_spider_key, judge_key = self.item_key(task_item, spider)
             detail_urls = list_item.get('detail_urls')
             next_page_url = list_item.get('next_page_url')
-            if detail_urls and self.filter_items_url(detail_urls, detail_task_info,
-                                                     master_spider_key, judge_key) and next_page_url:
-                self.is_push_next_page_url(next_page_url, list_task_info, master_spider_key)
-                spider.logger.info("[{1}]继续翻页，下一页：{0}".format(next_page_url, master_spider_key))
+            cache = item.context.meta.get('list_cache')
+            digest = None
+            if cache is not None and self.digests_key and detail_urls:
+                digest = self.urls_digest(detail_urls)
+                if digest == cache.get('digest'):  # 详情链接与上次相同,不再判重与翻页
+                    spider.crawler.stats.inc_value('list/unchanged')
+                    self.save_list_cache(task_item.get('url'), cache.get('validators'), digest)  # 更新校验信息
+                    return item
+            with self.latency.timer('filter_items_url', site_id=task_item.get('site_id')):
+                new_url_count = detail_urls and self.filter_items_url(detail_urls, detail_task_info,
+                                                                      detail_key, judge_key)
+            if detail_urls and (new_url_count or self.scan_page) and next_page_url:
+                stop = self.stop_pagination(list_task_info, new_url_count or 0, detail_urls,
+                                            list_item.get('newest_time'))
+                if stop:
+                    spider.crawler.stats.inc_value('pagination/stop/{0}'.format(stop))
+                    spider.logger.info("[{1}]停止翻页({2})：{0}".format(next_page_url, master_spider_key, stop))
+                else:
+                    self.is_push_next_page_url(next_page_url, list_task_info, master_spider_key)
+                    spider.logger.info("[{1}]继续翻页，下一页：{0}".format(next_page_url, master_spider_key))
+            if cache is not None:
+                self.save_list_cache(task_item.get('url'), cache.get('validators'), digest)
             del detail_task_info, list_task_info
             return item
         except Exception as e:
             spider.logger.error('RedisPipeline：{0}'.format(str(e)))
 
+    def get_pagination_policy(self, task):
+        """
+        翻页停止策略,优先取 站点id_模板id 的配置,其次站点id,与默认策略合并
+        :param task:
+        :return: dict
+        """
+        policy = dict(self.pagination_policy)
+        site_id = task.get('site_id')
+        template_id = task.get('template_id')
+        for key in ('{0}_{1}'.format(site_id, template_id), str(site_id)):
+            if key in self.pagination_policies:
+                policy.update(self.pagination_policies[key])
+                break
+        return policy
+
+    def stop_pagination(self, task, new_url_count, detail_urls, newest_time=None):
+        """
+        判断是否停止翻页,继续翻页时更新下一页任务的翻页状态
+        :param task: 下一页任务(当前列表任务的拷贝)
+        :param new_url_count: 本页新详情链接数
+        :param detail_urls: 本页详情链接
+        :param newest_time: 本页最新数据的时间戳(秒),由模板脚本parse_list返回
+        :return: 停止原因 max_depth / low_ratio / watermark, 继续翻页时为None
+        """
+        policy = self.get_pagination_policy(task)
+        depth = int(task.get('depth', DEEP_LEVEL))
+        max_depth = policy.get('max_depth', 0)
+        if max_depth and depth >= max_depth:
+            return 'max_depth'
+        low_pages = 0
+        min_new_ratio = policy.get('min_new_ratio', 0)
+        if min_new_ratio:
+            total = len(set(url for url in detail_urls if url)) if detail_urls else 0
+            if not total or float(new_url_count) / total < min_new_ratio:
+                low_pages = int(task.get('low_pages', 0)) + 1
+            if low_pages and low_pages >= policy.get('low_pages', 1):
+                return 'low_ratio'
+        watermark = task.get('watermark')
+        if policy.get('watermark') and newest_time is not None:
+            newest_time = float(newest_time)
+            if depth == DEEP_LEVEL:  # 入口页读取上次采集的水位线,并更新为本次最新时间
+                watermark = self.update_watermark(task.get('url'), newest_time)
+            if watermark is not None and newest_time <= watermark:
+                return 'watermark'
+        task['depth'] = depth + 1
+        if low_pages:
+            task['low_pages'] = low_pages
+        else:
+            task.pop('low_pages', None)
+        if watermark is not None:
+            task['watermark'] = watermark
+        return None
+
+    def update_watermark(self, url, newest_time):
+        """
+        更新入口列表的水位线
+        :param url: 入口列表页链接
+        :param newest_time: 本次最新数据的时间戳
+        :return: 上次采集的水位线,首次采集为None
+        """
+        watermark = self.redis_server.hget(self.watermark_key, url)
+        watermark = float(watermark) if watermark is not None else None
+        if watermark is None or newest_time > watermark:
+            self.redis_server.hset(self.watermark_key, url, newest_time)
+        return watermark
+
+    @staticmethod
+    def urls_digest(detail_urls):
+        """
+        列表页详情链接摘要
+        :param detail_urls:
+        :return:
+        """
+        return hashlib.md5('\n'.join(url for url in detail_urls if url).encode('utf-8')).hexdigest()
+
+    def save_list_cache(self, url, validators, digest):
+        """
+        列表页处理完成后保存校验信息与详情链接摘要,下次采集时用于条件请求与跳过未变化的列表页
+        :param url: 列表页链接
+        :param validators: {'etag': ..., 'last_modified': ...}
+        :param digest:
+        :return:
+        """
+        if not validators and not digest:
+            return
+        with self.redis_server.pipeline(transaction=False) as pipe:
+            if validators:
+                pipe.hset(self.validators_key, url, json.dumps(validators))
+            if digest:
+                pipe.hset(self.digests_key, url, digest)
+            pipe.execute()
+
     def is_push_next_page_url(self, url, next_page_task, master_spider_key):
         """
         存入下一页
@@ -88,7 +266,14 @@ class SpiderRedisPipeline(SpiderPipeline):
         """
         next_page_task['url'] = url  # 下一页翻页链接
         next_page_task['task_type'] = LIST_TASK  # 列表任务
-        self.redis_server.rpush(master_spider_key, json.dumps(next_page_task))  # 翻页链接放入父爬虫采集入口
+        priority = self.next_page_priority or next_page_task.get('priority')
+        data = self.codec.encode(next_page_task)
+        if self.fair_queue:
+            self.get_queue(master_spider_key).push(next_page_task.get('site_id'), [data], priority)
+        elif priority:
+            self.redis_server.lpush(master_spider_key, data)
+        else:
+            self.redis_server.rpush(master_spider_key, data)  # 翻页链接放入父爬虫采集入口
 
     def filter_items_url(self, detail_urls, task, detail_key, judge_key):
         """
@@ -97,21 +282,83 @@ class SpiderRedisPipeline(SpiderPipeline):
         :param task:
         :param detail_key:
         :param judge_key:
-        :return:
+        :return: 新详情链接数量
         """
-        if not self.scan_page:
-            new_url_count = 0
-        else:
-            new_url_count = 1
+        if not self.judge_batch:
+            return self._filter_each_url(detail_urls, task, detail_key, judge_key)
+        urls = list(dict.fromkeys(url for url in detail_urls if url))  # 页内去重并保持顺序
+        if not urls:
+            return 0
+        window = self.get_recrawl_window(task)
+        url_tasks = []
+        for url in urls:
+            task['url'] = url
+            task['task_type'] = DETAIL_TASK
+            url_tasks.append((url, self.codec.encode(task)))
+        # 判重与存入详情任务在redis端原子完成,多个主爬虫并行也不会重复下发
+        claimed = self.judge_store.claim_and_enqueue(judge_key, url_tasks=url_tasks, window=window,
+                                                     **self.detail_queue(detail_key, task))
+        return len(claimed)
+
+    def _filter_each_url(self, detail_urls, task, detail_key, judge_key):
+        """
+        逐条判重并存入详情任务(REDIS_JUDGE_BATCH=False 时使用)
+        :param detail_urls:
+        :param task:
+        :param detail_key:
+        :param judge_key:
+        :return: 新详情链接数量
+        """
+        new_url_count = 0
+        window = self.get_recrawl_window(task)
+        queue = self.detail_queue(detail_key, task)
         for url in detail_urls:
-            if url and not self.redis_server.hget(judge_key, url):  # 详情链接是否已经采集过
-                task['url'] = url
-                self.redis_server.hset(judge_key, url, int(time.time()))  # 详情链接加入判重队列
+            if not url:
+                continue
+            task['url'] = url
+            task['task_type'] = DETAIL_TASK
+            if self.judge_store.claim_and_enqueue(judge_key, url_tasks=[(url, self.codec.encode(task))],
+                                                  window=window, **queue):
                 new_url_count += 1
-                task['task_type'] = DETAIL_TASK
-                self.redis_server.rpush(detail_key, json.dumps(task))  # 存入详情采集任务
         return new_url_count
 
+    def get_queue(self, key):
+        """
+        按站点拆分的任务队列
+        :param key: 原始队列键
+        :return: FairQueue
+        """
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = FairQueue(self.redis_server, key, self.site_weights)
+        return queue
+
+    def detail_queue(self, detail_key, task):
+        """
+        详情任务入队的队列参数
+        :param detail_key:
+        :param task:
+        :return: dict
+        """
+        if not self.fair_queue:
+            return {'queue_key': detail_key}
+        queue = self.get_queue(detail_key)
+        site_id = task.get('site_id')
+        return {'queue_key': queue.site_key(site_id), 'sites_key': queue.sites_key, 'site_id': site_id}
+
+    def get_recrawl_window(self, task):
+        """
+        详情链接的重采周期,优先取 站点id_模板id 的配置,其次站点id,最后全局默认
+        :param task:
+        :return: int 秒,0为永不重采
+        """
+        site_id = task.get('site_id')
+        template_id = task.get('template_id')
+        for key in ('{0}_{1}'.format(site_id, template_id), str(site_id)):
+            if key in self.recrawl_windows:
+                return int(self.recrawl_windows[key])
+        return self.recrawl_window
+
     def item_key(self, item, spider):
         """
         字符串格式化储存键和判重键
@@ -125,42 +372,252 @@ class SpiderRedisPipeline(SpiderPipeline):
         return detail_key, master_spider_key, judge_key
 
 
+class ContentFingerprintStore:
+    """
+    详情数据内容指纹,field为_id前8字节、value为8字节内容摘要(均为二进制),按_id分到 shards 个hash中,
+    按 ttl 轮换代(键为 key:代号:分片),查询当前代与上一代,只在上一代中的未变化指纹转存到当前代,
+    每代的hash在 2*ttl 后过期,超过一代未再采集的数据指纹随之删除,再次采集时重新写入mongo
+    """
+
+    def __init__(self, server, key='%(name)s:content_fp:%(table)s', ttl=604800, shards=16):
+        self.server = server
+        self.key = key
+        self.ttl = ttl  # 每代的时长(秒)
+        self.shards = shards
+
+    @classmethod
+    def from_settings(cls, server, settings):
+        return cls(server, settings.get('MONGO_FINGERPRINT_KEY', '%(name)s:content_fp:%(table)s'),
+                   settings.getint('MONGO_FINGERPRINT_TTL', 604800), settings.getint('MONGO_FINGERPRINT_SHARDS', 16))
+
+    def shard_key(self, name, table, generation, _id):
+        return '{0}:{1}:{2}'.format(self.key % {'name': name, 'table': table}, generation,
+                                    int(_id[:8], 16) % self.shards)
+
+    @staticmethod
+    def field(_id):
+        return bytes.fromhex(_id)[:8]
+
+    def changed(self, name, table, entries):
+        """
+        过滤内容指纹与上次写入相同的数据
+        :param name: 爬虫名
+        :param table:
+        :param entries: [(UpdateOne, _id, 内容指纹)]
+        :return: (需要写入的数据, 只在上一代中找到的未变化数据)
+        """
+        generation = int(time.time() // self.ttl)
+        with self.server.pipeline(transaction=False) as pipe:
+            for _, _id, _ in entries:
+                pipe.hget(self.shard_key(name, table, generation, _id), self.field(_id))
+                pipe.hget(self.shard_key(name, table, generation - 1, _id), self.field(_id))
+            stored = pipe.execute()
+        changed, carried = [], []
+        for i, entry in enumerate(entries):
+            current, previous = stored[2 * i], stored[2 * i + 1]
+            if current is not None:  # 当前代的指纹最新,不再参考上一代
+                if current != entry[2]:
+                    changed.append(entry)
+            elif previous == entry[2]:
+                carried.append(entry)
+            else:
+                changed.append(entry)
+        return changed, carried
+
+    def save(self, name, table, entries):
+        """
+        内容指纹写入当前代
+        :param name:
+        :param table:
+        :param entries: [(UpdateOne, _id, 内容指纹)]
+        :return:
+        """
+        if not entries:
+            return
+        generation = int(time.time() // self.ttl)
+        mappings = defaultdict(dict)
+        for _, _id, fingerprint in entries:
+            mappings[self.shard_key(name, table, generation, _id)][self.field(_id)] = fingerprint
+        with self.server.pipeline(transaction=False) as pipe:
+            for key, mapping in mappings.items():
+                pipe.hset(key, mapping=mapping)
+                pipe.expire(key, self.ttl * 2)
+            pipe.execute()
+
+
 class SpiderMongoPipeline(SpiderPipeline):
+    """
+    详情数据按表缓冲,按条数或时间间隔以无序bulk_write批量写入mongo,写入在线程池中执行不阻塞reactor
+    """
+    client_cls = pymongo.MongoClient
 
-    def __init__(self, mongo_uri, mongo_db):
+    def __init__(self, mongo_uri, mongo_db, stats=None, bulk_size=500, flush_interval=1.0, buffer_max=5000,
+                 fingerprints=None):
         self.mongo_uri = mongo_uri
         self.mongo_db = mongo_db
         self.client = None
         self.client_db = None
         self.conn = None
+        self.stats = stats
+        self.bulk_size = bulk_size  # 缓冲达到该条数立即写入
+        self.flush_interval = flush_interval  # 定时写入间隔(秒)
+        self.buffer_max = buffer_max  # 缓冲+写入中的最大条数,超过后暂停接收新数据
+        self.buffer = defaultdict(list)  # 表名 -> [(UpdateOne, _id, 内容指纹)]
+        self.fingerprints = fingerprints  # ContentFingerprintStore,为None时不检查内容是否变化
+        self.buffered = 0
+        self.writing = 0
+        self.flush_task = None
+        self.spider = None
+        self.latency = LatencyRecorder(enabled=False)
+        self.members = []  # 缓冲数据对应的可靠队列处理中记录
+        self._flushing = set()
+        self._waiters = []
 
     @classmethod
     def from_crawler(cls, crawler):
-        return cls(
-            mongo_uri=crawler.settings.get('MONGO_URI'),
-            mongo_db=crawler.settings.get('MONGO_DATABASE', 'spider')
+        settings = crawler.settings
+        fingerprints = None
+        if settings.getbool('MONGO_FINGERPRINT_ENABLED'):
+            fingerprints = ContentFingerprintStore.from_settings(get_redis(crawler), settings)
+        s = cls(
+            mongo_uri=settings.get('MONGO_URI'),
+            mongo_db=settings.get('MONGO_DATABASE', 'spider'),
+            stats=crawler.stats,
+            bulk_size=settings.getint('MONGO_BULK_SIZE', 500),
+            flush_interval=settings.getfloat('MONGO_FLUSH_INTERVAL', 1.0),
+            buffer_max=settings.getint('MONGO_BUFFER_MAX', 5000),
+            fingerprints=fingerprints,
         )
+        s.latency = LatencyRecorder.from_crawler(crawler)
+        return s
 
     def open_spider(self, spider):
-        self.client = pymongo.MongoClient(self.mongo_uri)
+        self.client = self.client_cls(self.mongo_uri)
         self.client_db = self.client[self.mongo_db]
+        self.spider = spider
+        self.flush_task = LoopingCall(self.flush)
+        self.flush_task.start(self.flush_interval, now=False)
         spider.logger.info('SpiderMongoPipeline is staring')
 
     def close_spider(self, spider):
-        self.client.close()
-        spider.logger.info('SpiderMongoPipeline is closing')
+        if self.flush_task and self.flush_task.running:
+            self.flush_task.stop()
+        self.flush()
+        d = defer.DeferredList(list(self._flushing))
+
+        def _close(_):
+            self.client.close()
+            spider.logger.info('SpiderMongoPipeline is closing')
+        d.addBoth(_close)
+        return d
 
     def process_item(self, item, spider):
         if not spider.is_master:
-            task = spider._task
-            self.insert_data(task, item)
+            task = self.item_task(item)
+            if item.context.member:
+                self.members.append(item.context.member)
+            return self.insert_data(task, item)
 
     def insert_data(self, task, data):
+        """
+        详情数据放入写入缓冲,缓冲已满时返回Deferred等待写入完成(背压)
+        :param task:
+        :param data:
+        :return:
+        """
         table_name = task.get('table')
         url = task.get('url', '')
         _id = self.md5_url_id(url)
-        conn = self.client_db[table_name]
-        conn.update_one({'_id': _id}, {"$set": data}, upsert=True)
+        document = dict(data)
+        fingerprint = self.content_fingerprint(document) if self.fingerprints is not None else None
+        self.buffer[table_name].append((UpdateOne({'_id': _id}, {"$set": document}, upsert=True), _id, fingerprint))
+        self.buffered += 1
+        if self.buffered >= self.bulk_size:
+            self.flush()
+        if self.buffered + self.writing < self.buffer_max:
+            return data
+        d = defer.Deferred()
+        d.addCallback(lambda _: data)
+        self._waiters.append(d)
+        return d
+
+    def flush(self):
+        """
+        缓冲数据交给线程池批量写入
+        :return: Deferred
+        """
+        if not self.buffered:
+            return defer.succeed(None)
+        batches, count, members = self.buffer, self.buffered, self.members
+        self.buffer, self.buffered, self.members = defaultdict(list), 0, []
+        self.writing += count
+        d = deferToThread(self._bulk_write, batches)
+        d.addCallbacks(self._flushed, self._flush_failed, callbackArgs=(members,), errbackArgs=(count,))
+        self._flushing.add(d)
+        d.addBoth(self._flush_done, d, count)
+        return d
+
+    def _bulk_write(self, batches):
+        """
+        线程中执行,跳过内容未变化的数据后每个表一次无序bulk_write,写入成功后保存内容指纹
+        :param batches:
+        :return: (处理条数, 耗时毫秒, {'inserted': 新增数, 'updated': 更新数, 'unchanged': 未变化数})
+        """
+        start = time.time()
+        count = 0
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        for table_name, entries in batches.items():
+            count += len(entries)
+            carried = []
+            if self.fingerprints is not None:
+                changed, carried = self.fingerprints.changed(self.spider.name, table_name, entries)
+                counts['unchanged'] += len(entries) - len(changed)
+                entries = changed
+            if entries:
+                with self.latency.timer('insert_data', table=table_name):
+                    result = self.client_db[table_name].bulk_write([entry[0] for entry in entries], ordered=False)
+                counts['inserted'] += result.upserted_count
+                counts['updated'] += result.modified_count
+            if self.fingerprints is not None:
+                self.fingerprints.save(self.spider.name, table_name, entries + carried)
+        return count, (time.time() - start) * 1000, counts
+
+    @staticmethod
+    def content_fingerprint(document):
+        """
+        详情数据内容指纹,字段顺序不影响结果
+        :param document:
+        :return: 8字节摘要
+        """
+        content = json.dumps(document, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=8).digest()
+
+    def _flushed(self, result, members):
+        count, latency, counts = result
+        for member in members:  # 写入成功后确认任务,失败的任务超时后重新入队
+            self.spider.ack_task(member)
+        if self.stats:
+            for key, value in counts.items():
+                self.stats.inc_value('mongo/{0}'.format(key), value)
+            self.stats.inc_value('mongo/flush_count')
+            self.stats.inc_value('mongo/flush_items', count)
+            self.stats.set_value('mongo/batch_size', count)
+            self.stats.max_value('mongo/max_batch_size', count)
+            self.stats.set_value('mongo/flush_latency_ms', int(latency))
+            self.stats.max_value('mongo/max_flush_latency_ms', int(latency))
+
+    def _flush_failed(self, failure, count):
+        if self.stats:
+            self.stats.inc_value('mongo/flush_error')
+        logger.error('SpiderMongoPipeline批量写入失败({0}条)：{1}'.format(count, failure.getErrorMessage()))
+
+    def _flush_done(self, _, d, count):
+        self._flushing.discard(d)
+        self.writing -= count
+        if self.buffered + self.writing < self.buffer_max:
+            waiters, self._waiters = self._waiters, []
+            for waiter in waiters:
+                waiter.callback(None)
 
     @staticmethod
     def md5_url_id(url):
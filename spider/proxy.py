@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 14:20
+# @Author : shl
+# @File : proxy.py
+# @Desc : 代理ip池
+import logging
+from collections import OrderedDict, deque
+
+from scrapy.exceptions import IgnoreRequest
+from scrapy_redis.utils import bytes_to_str
+from twisted.internet import defer, reactor
+from twisted.internet.threads import deferToThread
+
+logger = logging.getLogger(__name__)
+
+
+class ProxyState:
+    """
+    单个代理的使用情况
+    """
+    __slots__ = ('uses', 'pending', 'taken_at', 'success', 'failure', 'continuous_failure', 'latency')
+
+    def __init__(self):
+        self.uses = 0
+        self.pending = 0  # 已取用但还未反馈结果的次数
+        self.taken_at = 0  # 最近一次取用的序号,得分相同时优先使用最久未用的代理
+        self.success = 0
+        self.failure = 0
+        self.continuous_failure = 0
+        self.latency = None  # 下载耗时的指数加权平均(秒)
+
+    def score(self, default_latency, failure_penalty):
+        """
+        代理得分,越小越好: 平均耗时 * (1 + 失败惩罚 * 失败率)
+        :param default_latency: 未使用过的代理按该耗时计算
+        :param failure_penalty:
+        :return:
+        """
+        latency = default_latency if self.latency is None else self.latency
+        total = self.success + self.failure
+        failure_rate = float(self.failure) / total if total else 0.0
+        return latency * (1 + failure_penalty * failure_rate)
+
+
+class ProxyPool:
+    """
+    本地代理池,批量从redis预取代理,取用时不阻塞reactor,代理为空时返回等待中的Deferred
+    按耗时与失败率给代理打分,优先使用得分最好的代理(得分相同时轮流使用),封禁或连续失败的代理直接移出
+    达到使用次数上限的代理退出轮换,状态保留到最后一次使用的结果反馈后再删除
+    """
+
+    def __init__(self, server, key, batch_size=20, max_uses=5, low_water=5, retry_delay=10,
+                 max_failures=3, failure_penalty=4.0, ewma_alpha=0.3, default_latency=1.0, max_retired=1000):
+        self.server = server
+        self.key = key
+        self.batch_size = batch_size  # 每次从redis预取的代理数
+        self.max_uses = max_uses  # 单个代理最多使用次数
+        self.low_water = low_water  # 本地代理数低于该值时后台预取
+        self.retry_delay = retry_delay  # redis中没有代理时的重试间隔(秒)
+        self.max_failures = max_failures  # 连续失败次数达到该值移出代理池
+        self.failure_penalty = failure_penalty
+        self.ewma_alpha = ewma_alpha
+        self.default_latency = default_latency
+        self.max_retired = max_retired  # 等待结果反馈的已退出代理数上限,请求未反馈结果时按先后顺序清理
+        self.proxies = deque()
+        self.states = {}
+        self.retired = OrderedDict()  # 已退出轮换、还有请求未反馈结果的代理
+        self._taken = 0
+        self._waiters = deque()
+        self._fetching = False
+        self._retry_call = None
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def get(self):
+        """
+        获取一个代理
+        :return: Deferred 代理地址 http://ip:port
+        """
+        if self.proxies:
+            proxy = self._take()
+            if len(self.proxies) < self.low_water:
+                self.refill()
+            return defer.succeed(proxy)
+        d = defer.Deferred()
+        self._waiters.append(d)
+        self.refill()
+        return d
+
+    def _take(self):
+        """
+        取用得分最好的代理,得分相同时取最久未用的,达到使用次数上限后退出轮换
+        :return:
+        """
+        proxy = min(self.proxies, key=self._rank)
+        state = self.states[proxy]
+        self._taken += 1
+        state.uses += 1
+        state.pending += 1
+        state.taken_at = self._taken
+        if state.uses >= self.max_uses:
+            self.retire(proxy)
+        return proxy
+
+    def _rank(self, proxy):
+        state = self.states[proxy]
+        return state.score(self.default_latency, self.failure_penalty), state.taken_at
+
+    def retire(self, proxy):
+        """
+        代理退出轮换,保留状态等待已取用请求的结果
+        :param proxy:
+        :return:
+        """
+        state = self.states.pop(proxy)
+        self.proxies.remove(proxy)
+        if state.pending > 0:
+            self.retired[proxy] = state
+            while len(self.retired) > self.max_retired:
+                self.retired.popitem(last=False)
+
+    def _feedback(self, proxy):
+        """
+        取出代理状态并记录一次结果反馈,已退出的代理收到最后一次反馈后删除状态
+        :param proxy:
+        :return: ProxyState 或 None
+        """
+        state = self.states.get(proxy)
+        if state is None:
+            state = self.retired.get(proxy)
+            if state is None:
+                return None
+            if state.pending <= 1:
+                del self.retired[proxy]
+        state.pending = max(state.pending - 1, 0)
+        return state
+
+    def discard(self, proxy):
+        """
+        移出代理池
+        :param proxy:
+        :return: bool 是否在代理池中
+        """
+        if self.states.pop(proxy, None) is None:
+            return False
+        self.proxies.remove(proxy)
+        return True
+
+    def report_success(self, proxy, latency=None):
+        """
+        记录代理请求成功
+        :param proxy:
+        :param latency: 下载耗时(秒)
+        :return:
+        """
+        state = self._feedback(proxy)
+        if state is None:
+            return
+        state.success += 1
+        state.continuous_failure = 0
+        if latency is not None:
+            if state.latency is None:
+                state.latency = latency
+            else:
+                state.latency += self.ewma_alpha * (latency - state.latency)
+
+    def report_failure(self, proxy, ban=False):
+        """
+        记录代理请求失败,被封禁或连续失败过多时移出代理池
+        :param proxy:
+        :param ban: 是否为封禁信号
+        :return: bool 是否被移出代理池
+        """
+        state = self._feedback(proxy)
+        if state is None:
+            return False
+        state.failure += 1
+        state.continuous_failure += 1
+        if ban or state.continuous_failure >= self.max_failures:
+            return self.discard(proxy)
+        return False
+
+    def refill(self):
+        """
+        后台从redis预取一批代理
+        :return:
+        """
+        if self._fetching:
+            return
+        self._fetching = True
+        d = deferToThread(self._fetch)
+        d.addCallbacks(self._fetched, self._fetch_failed)
+
+    def _fetch(self):
+        with self.server.pipeline() as pipe:
+            pipe.lrange(self.key, 0, self.batch_size - 1)
+            pipe.ltrim(self.key, self.batch_size, -1)
+            datas, _ = pipe.execute()
+        return datas
+
+    def _fetched(self, datas):
+        self._fetching = False
+        for ip_str in datas:
+            proxy = 'http://{0}'.format(bytes_to_str(ip_str))
+            if proxy not in self.states:
+                state = self.retired.pop(proxy, None)  # 重新放入的代理沿用之前的耗时与失败统计
+                if state is not None:
+                    state.uses = 0
+                self.states[proxy] = state or ProxyState()
+                self.proxies.append(proxy)
+        while self._waiters and self.proxies:
+            self._waiters.popleft().callback(self._take())
+        if self._waiters:
+            self._retry_later()
+
+    def _fetch_failed(self, failure):
+        self._fetching = False
+        logger.error('获取代理ip失败：{0}'.format(failure.getErrorMessage()))
+        if self._waiters:
+            self._retry_later()
+
+    def _retry_later(self):
+        if self._retry_call and self._retry_call.active():
+            return
+        logger.info("未获取到代理ip,{0}秒后重新获取~~~".format(self.retry_delay))
+        self._retry_call = reactor.callLater(self.retry_delay, self.refill)
+
+    def close(self):
+        """
+        停止重新获取,等待代理的请求不再等待,按忽略处理
+        :return:
+        """
+        if self._retry_call and self._retry_call.active():
+            self._retry_call.cancel()
+        waiters, self._waiters = self._waiters, deque()
+        for d in waiters:
+            d.errback(IgnoreRequest('代理池已关闭'))
@@ -0,0 +1,364 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 16:25
+# @Author : shl
+# @File : queue.py
+# @Desc : 按站点公平调度的任务队列
+import time
+from collections import defaultdict
+
+from scrapy_redis.utils import bytes_to_str
+
+# 按各站点与原始队列(未按站点拆分的任务,如外部写入的入口任务)的配额批量出队,配额未取满时从其他站点补齐,最后从原始队列补齐
+# 可靠模式下出队的任务同时以 worker_id\n站点id\n任务 写入处理中zset(原始队列的任务站点id为空),分值为超时时间
+# KEYS[1]: 站点集合  KEYS[2]: 原始队列  KEYS[3]: 处理中zset
+# ARGV[1]: 批量大小  ARGV[2]: 站点队列前缀  ARGV[3]: 超时时间(0为非可靠模式)  ARGV[4]: worker_id
+# ARGV[5]: 原始队列配额  ARGV[6..]: site, quota 交替排列
+# 返回 {任务列表, 各站点出队数 site, count 交替排列, 仍有任务的站点, 原始队列出队数, 原始队列剩余任务数}
+FAIR_POP_SCRIPT = """
+local batch = tonumber(ARGV[1])
+local prefix = ARGV[2]
+local deadline = tonumber(ARGV[3])
+local datas = {}
+local counts = {}
+local popped = {}
+local raw = 0
+
+local function pop(key, n, site)
+    if n <= 0 then
+        return 0
+    end
+    local items = redis.call('LRANGE', key, 0, n - 1)
+    if #items > 0 then
+        redis.call('LTRIM', key, #items, -1)
+        for _, item in ipairs(items) do
+            if deadline > 0 then
+                item = ARGV[4] .. '\\n' .. site .. '\\n' .. item
+                redis.call('ZADD', KEYS[3], deadline, item)
+            end
+            datas[#datas + 1] = item
+        end
+    end
+    return #items
+end
+
+local function take(site, n)
+    local got = pop(prefix .. site, n, site)
+    popped[site] = (popped[site] or 0) + got
+    return got
+end
+
+raw = raw + pop(KEYS[2], math.min(tonumber(ARGV[5]), batch), '')
+for i = 6, #ARGV, 2 do
+    take(ARGV[i], math.min(tonumber(ARGV[i + 1]), batch - #datas))
+end
+local sites = redis.call('SMEMBERS', KEYS[1])
+for _, site in ipairs(sites) do
+    if #datas >= batch then
+        break
+    end
+    take(site, batch - #datas)
+end
+raw = raw + pop(KEYS[2], batch - #datas, '')
+
+local active = {}
+for _, site in ipairs(sites) do
+    if redis.call('LLEN', prefix .. site) > 0 then
+        active[#active + 1] = site
+    else
+        redis.call('SREM', KEYS[1], site)
+    end
+end
+for site, count in pairs(popped) do
+    counts[#counts + 1] = site
+    counts[#counts + 1] = count
+end
+return {datas, counts, active, raw, redis.call('LLEN', KEYS[2])}
+"""
+
+# KEYS[1]: 任务队列  KEYS[2]: 处理中zset
+# ARGV[1]: 批量大小  ARGV[2]: 超时时间  ARGV[3]: worker_id
+RELIABLE_POP_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+local members = {}
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    for i, item in ipairs(items) do
+        members[i] = ARGV[3] .. '\\n\\n' .. item
+        redis.call('ZADD', KEYS[2], ARGV[2], members[i])
+    end
+end
+return members
+"""
+
+# 超时未确认的任务放回出队时的站点队列队首,站点id为空(原始队列或非按站点拆分)时放回原始队列队首
+# 每次回收累加任务的投递次数,达到上限的任务移入死信队列,不再反复回收
+# KEYS[1]: 处理中zset  KEYS[2]: 原始队列  KEYS[3]: 站点集合  KEYS[4]: 投递次数hash  KEYS[5]: 死信队列
+# ARGV[1]: 当前时间  ARGV[2]: 单次最多放回数  ARGV[3]: 站点队列前缀(非按站点拆分时为空)
+# ARGV[4]: 最多投递次数(0为不限)  ARGV[5]: 死信队列最大长度
+# 返回 {放回数, 移入死信队列数}
+REAP_SCRIPT = """
+local members = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local max_deliveries = tonumber(ARGV[4])
+local requeued = 0
+local dead = 0
+for _, member in ipairs(members) do
+    local first = string.find(member, '\\n', 1, true)
+    local second = string.find(member, '\\n', first + 1, true)
+    local site = string.sub(member, first + 1, second - 1)
+    local payload = string.sub(member, second + 1)
+    local deliveries = redis.call('HINCRBY', KEYS[4], payload, 1)
+    if max_deliveries > 0 and deliveries >= max_deliveries then
+        redis.call('LPUSH', KEYS[5], payload)
+        redis.call('LTRIM', KEYS[5], 0, tonumber(ARGV[5]) - 1)
+        redis.call('HDEL', KEYS[4], payload)
+        dead = dead + 1
+    elseif site ~= '' and ARGV[3] ~= '' then
+        redis.call('LPUSH', ARGV[3] .. site, payload)
+        redis.call('SADD', KEYS[3], site)
+        requeued = requeued + 1
+    else
+        redis.call('LPUSH', KEYS[2], payload)
+        requeued = requeued + 1
+    end
+    redis.call('ZREM', KEYS[1], member)
+end
+return {requeued, dead}
+"""
+
+# 已出队但未处理的任务移出处理中zset并放回出队时的队列队首(保持原顺序),已被回收的任务不再放回
+# KEYS[1]: 处理中zset  KEYS[2]: 原始队列  KEYS[3]: 站点集合
+# ARGV[1]: 站点队列前缀(非按站点拆分时为空)  ARGV[2..]: 处理中记录
+RELEASE_SCRIPT = """
+local released = 0
+for i = #ARGV, 2, -1 do
+    local member = ARGV[i]
+    if redis.call('ZREM', KEYS[1], member) == 1 then
+        local first = string.find(member, '\\n', 1, true)
+        local second = string.find(member, '\\n', first + 1, true)
+        local site = string.sub(member, first + 1, second - 1)
+        local payload = string.sub(member, second + 1)
+        if site ~= '' and ARGV[1] ~= '' then
+            redis.call('LPUSH', ARGV[1] .. site, payload)
+            redis.call('SADD', KEYS[3], site)
+        else
+            redis.call('LPUSH', KEYS[2], payload)
+        end
+        released = released + 1
+    end
+end
+return released
+"""
+
+# KEYS[1]: 站点集合  KEYS[2]: 原始队列  ARGV[1]: 站点队列前缀
+FAIR_COUNT_SCRIPT = """
+local total = redis.call('LLEN', KEYS[2])
+for _, site in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    total = total + redis.call('LLEN', ARGV[1] .. site)
+end
+return total
+"""
+
+
+class FairQueue:
+    """
+    按站点拆分的redis任务队列,每个站点一个list,出队时按站点权重做差额轮询(DRR),
+    一次往返取出各站点均衡的一批任务,避免大站点占满采集带宽
+    原始队列(未按站点拆分的任务)作为一个权重为 raw_weight 的参与者参加轮询,不会因站点队列积压而一直取不到
+    """
+    RAW = ''  # 原始队列在配额中的标识,站点id不会为空字符串
+
+    def __init__(self, server, key, weights=None, default_weight=1.0, raw_weight=1.0):
+        self.server = server
+        self.key = key  # 原始队列键,站点队列为 key:site_id
+        self.sites_key = '{0}:sites'.format(key)
+        self.prefix = '{0}:'.format(key)
+        self.weights = {str(k): float(v) for k, v in (weights or {}).items()}
+        self.default_weight = default_weight
+        self.raw_weight = raw_weight
+        self.deficit = defaultdict(float)
+        self.active = set()
+        self.raw_active = True  # 原始队列是否还有任务,启动时未知,按有任务处理
+        self._pop_script = server.register_script(FAIR_POP_SCRIPT)
+        self._count_script = server.register_script(FAIR_COUNT_SCRIPT)
+
+    def site_key(self, site_id):
+        return '{0}{1}'.format(self.prefix, site_id)
+
+    def weight(self, site_id):
+        if site_id == self.RAW:
+            return self.raw_weight
+        return self.weights.get(str(site_id), self.default_weight)
+
+    def push(self, site_id, datas, priority=False):
+        """
+        任务存入站点队列
+        :param site_id:
+        :param datas: 任务列表
+        :param priority: 优先任务放入队首
+        :return:
+        """
+        if not datas:
+            return
+        with self.server.pipeline(transaction=True) as pipe:
+            if priority:
+                pipe.lpush(self.site_key(site_id), *reversed(datas))
+            else:
+                pipe.rpush(self.site_key(site_id), *datas)
+            pipe.sadd(self.sites_key, site_id)
+            pipe.execute()
+
+    def quotas(self, batch_size):
+        """
+        按权重给各站点与原始队列分配本批次出队数,未用完的配额累计到下一批次
+        :param batch_size:
+        :return: {site_id: quota}, 原始队列的配额key为 RAW
+        """
+        participants = set(self.active)
+        if self.raw_active and self.raw_weight > 0:
+            participants.add(self.RAW)
+        if not participants:
+            return {}
+        total = sum(self.weight(site) for site in participants)
+        quotas = {}
+        for site in participants:
+            self.deficit[site] += batch_size * self.weight(site) / total
+            quotas[site] = int(self.deficit[site])
+        return quotas
+
+    def pop(self, batch_size, processing_key=None, deadline=0, worker_id=''):
+        """
+        按站点公平批量出队
+        :param batch_size:
+        :param processing_key: 可靠模式下的处理中zset
+        :param deadline: 可靠模式下的超时时间
+        :param worker_id:
+        :return: list 任务(可靠模式下为 worker_id\\n站点id\\n任务)
+        """
+        quotas = self.quotas(batch_size)
+        args = [batch_size, self.prefix, deadline, worker_id, quotas.get(self.RAW, 0)]
+        for site, quota in quotas.items():
+            if site != self.RAW:
+                args.extend((site, quota))
+        keys = [self.sites_key, self.key, processing_key or '{0}:processing'.format(self.key)]
+        datas, counts, active, raw, raw_left = self._pop_script(keys=keys, args=args)
+        popped = {self.RAW: int(raw)}
+        for i in range(0, len(counts), 2):
+            popped[bytes_to_str(counts[i])] = int(counts[i + 1])
+        self.active = set(bytes_to_str(site) for site in active)
+        self.raw_active = int(raw_left) > 0
+        for site, quota in quotas.items():
+            if site in self.active or (site == self.RAW and self.raw_active):
+                self.deficit[site] = max(self.deficit[site] - popped.get(site, 0), 0)
+            else:
+                self.deficit.pop(site, None)  # 队列已空,差额清零
+        return datas
+
+    def count(self):
+        return int(self._count_script(keys=[self.sites_key, self.key], args=[self.prefix]))
+
+
+class ReliableQueue:
+    """
+    可靠任务队列,出队的任务移入处理中zset(分值为超时时间),数据保存后确认删除,
+    超时未确认的任务(子爬虫崩溃或被杀)由回收任务放回出队时的站点队列,
+    超时次数达到 max_deliveries 或解析/入库出错的任务移入死信队列(key:dead),排查后可手动放回任务队列
+    """
+
+    def __init__(self, server, key, worker_id, timeout=600, fair_queue=None, max_deliveries=3, dead_max=10000):
+        self.server = server
+        self.key = key
+        self.worker_id = worker_id
+        self.timeout = timeout  # 任务处理超时时间(秒)
+        self.fair_queue = fair_queue
+        self.max_deliveries = max_deliveries  # 最多投递次数,0为不限
+        self.dead_max = dead_max  # 死信队列最大长度,超过后丢弃最早的任务
+        self.processing_key = '{0}:processing'.format(key)
+        self.deliveries_key = '{0}:deliveries'.format(key)  # 被回收过的任务的投递次数, field为任务
+        self.dead_key = '{0}:dead'.format(key)
+        self.pending_acks = []
+        self.pending_dead = []
+        self._pop_script = server.register_script(RELIABLE_POP_SCRIPT)
+        self._reap_script = server.register_script(REAP_SCRIPT)
+        self._release_script = server.register_script(RELEASE_SCRIPT)
+
+    @staticmethod
+    def payload(member):
+        """
+        处理中记录对应的原始任务
+        :param member: worker_id\\n站点id\\n任务
+        :return:
+        """
+        return member.split(b'\n', 2)[2]
+
+    def pop(self, batch_size):
+        deadline = int(time.time() + self.timeout)
+        if self.fair_queue is not None:
+            return self.fair_queue.pop(batch_size, self.processing_key, deadline, self.worker_id)
+        return self._pop_script(keys=[self.key, self.processing_key],
+                                args=[batch_size, deadline, self.worker_id])
+
+    def ack(self, member):
+        """
+        确认任务已完成,批量提交
+        :param member:
+        :return:
+        """
+        self.pending_acks.append(member)
+
+    def dead(self, member):
+        """
+        任务移入死信队列,批量提交
+        :param member:
+        :return:
+        """
+        self.pending_dead.append(member)
+
+    def flush_acks(self):
+        """
+        提交已确认与移入死信队列的任务
+        :return: int 提交数
+        """
+        members, self.pending_acks = self.pending_acks, []
+        dead, self.pending_dead = self.pending_dead, []
+        if not members and not dead:
+            return 0
+        with self.server.pipeline(transaction=False) as pipe:
+            pipe.zrem(self.processing_key, *(members + dead))
+            pipe.hdel(self.deliveries_key, *[self.payload(member) for member in members + dead])
+            if dead:
+                pipe.lpush(self.dead_key, *[self.payload(member) for member in dead])
+                pipe.ltrim(self.dead_key, 0, self.dead_max - 1)
+            pipe.execute()
+        return len(members) + len(dead)
+
+    def reap(self, limit=100):
+        """
+        超时未确认的任务放回任务队列,投递次数达到上限的移入死信队列
+        :param limit: 单次最多回收数
+        :return: (放回数, 移入死信队列数)
+        """
+        prefix, sites_key = self._requeue_keys()
+        keys = [self.processing_key, self.key, sites_key, self.deliveries_key, self.dead_key]
+        requeued, dead = self._reap_script(keys=keys, args=[int(time.time()), limit, prefix,
+                                                            self.max_deliveries, self.dead_max])
+        return int(requeued), int(dead)
+
+    def release(self, members):
+        """
+        已出队但未发出请求的任务放回任务队列,不计入投递次数
+        :param members: 处理中记录
+        :return: int 放回数
+        """
+        if not members:
+            return 0
+        prefix, sites_key = self._requeue_keys()
+        return int(self._release_script(keys=[self.processing_key, self.key, sites_key], args=[prefix] + list(members)))
+
+    def _requeue_keys(self):
+        prefix = self.fair_queue.prefix if self.fair_queue is not None else ''
+        sites_key = self.fair_queue.sites_key if self.fair_queue is not None else '{0}:sites'.format(self.key)
+        return prefix, sites_key
+
+    def processing(self):
+        return self.server.zcard(self.processing_key)
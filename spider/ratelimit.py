@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 22:05
+# @Author : shl
+# @File : ratelimit.py
+# @Desc : redis令牌桶,所有爬虫进程共享同一个请求速率上限
+import logging
+import time
+from collections import deque
+
+from twisted.internet import defer, reactor
+from twisted.internet.threads import deferToThread
+
+logger = logging.getLogger(__name__)
+
+# 令牌桶按redis服务器时间补充令牌,一次最多取走ARGV[3]个
+# KEYS[1]: 令牌桶hash(tokens, ts)
+# ARGV[1]: 每秒令牌数  ARGV[2]: 桶容量  ARGV[3]: 本次申请的令牌数
+# 返回 {取得的令牌数, 下一个令牌的等待时间(毫秒)}
+TOKEN_BUCKET_SCRIPT = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate / 1000)
+local granted = math.min(math.floor(tokens), requested)
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+local wait = 0
+if tokens < 1 then
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+return {granted, wait}
+"""
+
+
+class TokenBucket:
+    """
+    单个限速键的本地令牌缓存,令牌不足时一次lua调用批量申请,等待中的请求按先后顺序获得令牌
+    缓存的令牌超过ttl未用完即作废,避免进程囤积令牌突破整体速率
+    """
+
+    def __init__(self, limiter, key, rate, capacity):
+        self.limiter = limiter
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = 0
+        self.fetched_at = 0.0
+        self.waiters = deque()
+        self.fetching = False
+        self.retry_call = None
+
+    def acquire(self):
+        if self.tokens and time.time() - self.fetched_at > self.limiter.token_ttl:
+            self.tokens = 0
+        if self.tokens and not self.waiters:
+            self.tokens -= 1
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.waiters.append(d)
+        self.fetch()
+        return d
+
+    def fetch(self):
+        if self.fetching or (self.retry_call and self.retry_call.active()):
+            return
+        self.fetching = True
+        requested = max(min(len(self.waiters) + self.limiter.batch_size - 1, self.capacity), 1)
+        d = deferToThread(self.limiter.take, self.key, self.rate, self.capacity, requested)
+        d.addCallbacks(self._fetched, self._fetch_failed)
+
+    def _fetched(self, result):
+        self.fetching = False
+        granted, wait = int(result[0]), int(result[1])
+        self.tokens += granted
+        self.fetched_at = time.time()
+        while self.waiters and self.tokens:
+            self.tokens -= 1
+            self.waiters.popleft().callback(None)
+        if self.waiters:
+            self.retry_call = reactor.callLater(max(wait, 10) / 1000.0, self.fetch)
+
+    def _fetch_failed(self, failure):
+        self.fetching = False
+        logger.error('令牌获取失败[{0}]：{1}'.format(self.key, failure.getErrorMessage()))
+        if self.waiters:
+            self.retry_call = reactor.callLater(self.limiter.retry_delay, self.fetch)
+
+    def close(self):
+        if self.retry_call and self.retry_call.active():
+            self.retry_call.cancel()
+
+
+class RateLimiter:
+    """
+    按域名或站点限速,速率为所有爬虫进程合计的每秒请求数
+    """
+
+    def __init__(self, server, key, rates, default_rate=0, burst=1.0, batch_size=5, token_ttl=1.0,
+                 retry_delay=1.0):
+        self.server = server
+        self.key = key  # 令牌桶键,如 spider:ratelimit:%(name)s
+        self.rates = {str(k): float(v) for k, v in (rates or {}).items()}
+        self.default_rate = default_rate  # 未单独配置的速率,0为不限速
+        self.burst = burst  # 桶容量 = 速率 * burst秒
+        self.batch_size = batch_size  # 每次申请的令牌数
+        self.token_ttl = token_ttl  # 本地缓存令牌的有效期(秒)
+        self.retry_delay = retry_delay
+        self.buckets = {}
+        self._script = server.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def bucket(self, name):
+        """
+        :param name: 域名或站点id
+        :return: TokenBucket, 不限速时为None
+        """
+        name = str(name)
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            rate = self.rates.get(name, self.default_rate)
+            if rate <= 0:
+                return None
+            capacity = max(int(rate * self.burst), 1)
+            bucket = self.buckets[name] = TokenBucket(self, self.key % {'name': name}, rate, capacity)
+        return bucket
+
+    def take(self, key, rate, capacity, requested):
+        """
+        从redis令牌桶申请令牌(在线程中执行)
+        :return: (取得的令牌数, 等待时间毫秒)
+        """
+        return self._script(keys=[key], args=[rate, capacity, requested])
+
+    def close(self):
+        for bucket in self.buckets.values():
+            bucket.close()
@@ -20,6 +20,8 @@ ROBOTSTXT_OBEY = False
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
 # CONCURRENT_REQUESTS = 32
+DOWNLOADER = 'spider.downloader.ParkingDownloader'  # 在中间件中等待并发/令牌的请求不占用 CONCURRENT_REQUESTS
+DOWNLOADER_MAX_PARKED = 0  # 最多停靠(等待中不占用并发)的请求数,0为 CONCURRENT_REQUESTS*4
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -52,7 +54,10 @@ SPIDER_MIDDLEWARES = {
 DOWNLOADER_MIDDLEWARES = {
     'spider.middlewares.SpiderDownloaderMiddleware': None,
     'scrapy.downloadermiddlewares.httpproxy.HttpProxyMiddleware': None,
-    'spider.middlewares.SpiderProxyMiddleware': 300,
+    'spider.middlewares.SpiderProxyMiddleware': 590,  # 需大于RetryMiddleware(550),先处理代理异常,不与RedirectMiddleware(600)同级
+    'spider.middlewares.SpiderRateLimitMiddleware': 620,  # 分配代理后、占用并发前等待令牌
+    'spider.middlewares.SpiderConditionalMiddleware': 630,  # 主爬虫列表页条件请求
+    'spider.middlewares.SpiderThrottleMiddleware': 650,  # 需大于SpiderProxyMiddleware,分配代理后按域名限流,按(域名,代理)判断封禁
     'spider.middlewares.SpiderUserAgentMiddleware': 200
 }
 
@@ -88,22 +93,125 @@ INFLUXDB_PARAMS = {
     'password': '123456',
     'database': 'spider',
 }
+LATENCY_METRICS_ENABLED = True  # 统计下载/解析/判重/入库耗时分位数,随统计数据写入influxdb
+INFLUXDB_BATCH_SIZE = 500  # 每次写入influxdb的数据点数
+INFLUXDB_FLUSH_INTERVAL = 5  # 写入influxdb间隔(秒)
+INFLUXDB_MAX_POINTS = 10000  # influxdb不可用时缓冲的最大数据点数,超过后丢弃最早的数据点
+INFLUXDB_MAX_BACKOFF = 300  # 写入失败重试的最大退避时间(秒)
+INFLUXDB_TIMEOUT = 10  # influxdb请求超时时间(秒),INFLUXDB_PARAMS中未设置timeout时使用
+INFLUXDB_CLOSE_TIMEOUT = 30  # 关闭时等待写入剩余数据点的最长时间(秒),超时后放弃剩余数据点
 MONGO_URI = 'mongodb://localhost:27017/'  # mongo链接地址
 MONGO_DATABASE = 'spider'  # mongo数据库database名字
+MONGO_BULK_SIZE = 500  # 详情数据缓冲达到该条数立即批量写入
+MONGO_FLUSH_INTERVAL = 1.0  # 详情数据定时批量写入间隔(秒)
+MONGO_BUFFER_MAX = 5000  # 缓冲+写入中的最大条数,超过后暂停接收新数据
+MONGO_FINGERPRINT_ENABLED = True  # 详情数据内容指纹与上次写入相同时不再写入mongo
+MONGO_FINGERPRINT_KEY = '%(name)s:content_fp:%(table)s'  # 内容指纹hash前缀,实际键为 前缀:代号:分片,field为数据_id前8字节
+MONGO_FINGERPRINT_TTL = 604800  # 内容指纹每代时长(秒,7天),超过一代未再采集的数据指纹过期删除
+MONGO_FINGERPRINT_SHARDS = 16  # 每代内容指纹按_id拆分的hash数
 
 REDIS_START_URLS_BATCH_SIZE = 16
+FEEDER_ENABLED = True  # 持续补充任务保持在途请求数,不再等爬虫空闲才获取
+FEEDER_TARGET = 0  # 目标在途请求数,0为 CONCURRENT_REQUESTS*2
+FEEDER_INTERVAL = 0.5  # 检查在途请求数的间隔(秒)
+FEEDER_MIN_BATCH = 1  # 每批获取任务数下限
+FEEDER_MAX_BATCH = 200  # 每批获取任务数上限
 REDIS_URL = 'redis://localhost:6379/1'  # redis链接地址
+REDIS_POOL_MAX_CONNECTIONS = 0  # 每个进程redis连接池的连接数上限,0为不限制(需大于线程池与解析线程数之和)
+REDIS_HEALTH_CHECK_INTERVAL = 30  # 连接空闲超过该时间(秒)后使用前先PING检查
+REDIS_SOCKET_KEEPALIVE = True  # 开启TCP keepalive,及时发现断开的连接
+REDIS_HIREDIS = None  # 响应解析器: None(安装了hiredis时自动使用) / True(hiredis) / False(python)
 REDIS_START_URLS_KEY = '%(name)s:detail_urls'  # 子爬虫队列
 REDIS_START_URLS_MASTER_KEY = '%(name)s:master_urls'  # 主爬虫队列
 REDIS_JUDGE_KEY = 'spider:judge_url:%(name)s'  # 判重队列
+TASK_CODEC = 'json'  # 任务编码: json / msgpack(任务头只保存一次,队列中只存url等逐条字段,所有爬虫升级后再开启)
+REDIS_TASK_HEADERS_KEY = '%(name)s:task_headers'  # msgpack编码的任务头
+REDIS_FAIR_QUEUE = False  # 主/子爬虫队列按站点拆分(队列键:站点id),按站点权重轮询出队(需显式开启,所有爬虫升级后再开启)
+SITE_WEIGHTS = {}  # 站点出队权重,如 {'12': 3},默认1
+RAW_QUEUE_WEIGHT = 1  # 原始队列(未按站点拆分的任务,如外部写入的入口任务、旧版本写入的任务)的出队权重
+RELIABLE_QUEUE = False  # 可靠队列(需显式开启,所有爬虫升级后再开启): 任务出队后进入处理中zset,数据保存后确认,超时未确认重新入队
+RELIABLE_TIMEOUT = 600  # 任务处理超时时间(秒)
+RELIABLE_ACK_INTERVAL = 1  # 批量确认任务间隔(秒)
+RELIABLE_REAP_INTERVAL = 30  # 回收超时任务间隔(秒)
+RELIABLE_REAP_BATCH = 100  # 单次最多回收的超时任务数
+RELIABLE_MAX_DELIVERIES = 3  # 任务最多投递次数(超时回收后重新投递),达到后移入死信队列(任务队列key:dead),0为不限
+RELIABLE_DEAD_MAX = 10000  # 死信队列最大长度,超过后丢弃最早的任务
+WORKER_ID = None  # 爬虫进程标识,默认 主机名:pid
+LAUNCHER_WORKERS = 0  # spider.launcher 默认启动的进程数,0为cpu核数
+LAUNCHER_RESTART_DELAY = 1  # 进程退出后的重启等待时间(秒)
+LAUNCHER_MAX_RESTART_DELAY = 60  # 进程反复崩溃时的最大重启等待时间(秒)
+LAUNCHER_MIN_UPTIME = 30  # 运行时间短于该值(秒)退出视为崩溃,重启等待时间翻倍
+LAUNCHER_STOP_TIMEOUT = 60  # 停止时等待进程正常结束的时间(秒),超时强制结束
+STATS_AGGREGATE_SOCKET = None  # 由launcher设置,统计数据发给launcher汇总后写入influxdb
+NEXT_PAGE_PRIORITY = False  # 翻页任务放入站点队列队首,优先于新的入口任务
+REDIS_JUDGE_STORE = 'hash'  # 判重存储: hash(原始链接) / fingerprint(8字节指纹) / bloom(布隆位图) 或类路径
+REDIS_JUDGE_BLOOM_BIT = 26  # bloom判重每个站点位图大小,26表示2^26位=8MB
+REDIS_JUDGE_BLOOM_HASH_NUMBER = 6  # bloom判重哈希函数个数
+REDIS_JUDGE_EXPIRE_BATCH = 100  # 每次判重顺带清理的已过期记录数
+RECRAWL_WINDOW = 0  # 详情链接默认重采周期(秒),0为永不重采
+RECRAWL_WINDOWS = {}  # 按站点配置重采周期,如 {'12': 86400, '12_3': 3600} (站点id 或 站点id_模板id)
+REDIS_JUDGE_BATCH = True  # 整页详情链接批量判重入队(redis端lua脚本原子完成)
 
 IS_PROXY = True  # 是否使用代理
 PROXY_REDIS_KEY = 'IP_PROXY'  # 代理存放队列
+PROXY_BATCH_SIZE = 20  # 每次从代理队列预取的代理数
+PROXY_MAX_USES = 5  # 单个代理最多使用次数
+PROXY_LOW_WATER = 5  # 本地代理数低于该值时后台预取
+PROXY_RETRY_DELAY = 10  # 代理队列为空时的重试间隔(秒)
+PROXY_BAN_CODES = [403, 429]  # 视为代理被封禁的响应状态码
+PROXY_MAX_FAILURES = 3  # 代理连续失败次数达到该值移出代理池
+PROXY_FAILURE_PENALTY = 4.0  # 代理得分的失败率惩罚系数
+PROXY_RETRY_TIMES = 3  # 代理封禁或异常时换代理重试次数
+
+THROTTLE_ENABLED = True  # 按域名自适应并发控制(AIMD),限制域名经所有代理的总并发,替代AutoThrottle
+THROTTLE_START_CONCURRENCY = 4  # 新域名的初始并发数
+THROTTLE_MIN_CONCURRENCY = 1
+THROTTLE_MAX_CONCURRENCY = 32  # 同时受 CONCURRENT_REQUESTS_PER_DOMAIN 限制
+THROTTLE_INCREASE = 1.0  # 请求正常时每轮增加的并发数
+THROTTLE_DECREASE = 0.5  # 封禁/异常/耗时过高时并发数乘以该系数
+THROTTLE_LATENCY_FACTOR = 3.0  # 下载耗时超过基准耗时的该倍数视为过载
+THROTTLE_BAN_CODES = [403, 429]  # 视为被封禁的响应状态码
+THROTTLE_CAPTCHA_PATTERNS = []  # 响应中出现即视为验证码页的特征,如 ['captcha', '验证码']
+THROTTLE_REDIS_KEY = 'spider:throttle'  # 各域名学习到的并发数,所有爬虫进程共享
+THROTTLE_SYNC_INTERVAL = 10  # 同步并发数间隔(秒)
+THROTTLE_IDLE_TIMEOUT = 300  # 空闲超过该时间(秒)的(域名,代理)状态被清理
+THROTTLE_MAX_PARKED = 16  # 每个域名最多停靠的等待请求数,超过后等待中的请求占用全局并发
+
+RATE_LIMITS = {}  # 所有爬虫进程合计的每秒请求数,如 {'www.example.com': 5} 或按站点 {'12': 2}
+RATE_LIMIT_DEFAULT = 0  # 未单独配置的域名/站点的速率,0为不限速
+RATE_LIMIT_BY = 'domain'  # 限速维度: domain(域名) / site(站点id)
+RATE_LIMIT_BURST = 1.0  # 令牌桶容量 = 速率 * 该秒数
+RATE_LIMIT_BATCH = 5  # 每次从redis申请的令牌数,本地缓存减少redis往返
+RATE_LIMIT_TOKEN_TTL = 1.0  # 本地缓存令牌的有效期(秒)
+RATE_LIMIT_REDIS_KEY = 'spider:ratelimit:%(name)s'  # 令牌桶键
+RATE_LIMIT_MAX_PARKED = 16  # 每个限速键最多停靠的等待令牌请求数,超过后等待中的请求占用全局并发
 
 SCAN_PAGE = False
+PAGINATION_POLICY = {}  # 默认翻页停止策略,见 PAGINATION_POLICIES
+# 按站点配置翻页停止策略(站点id 或 站点id_模板id),如 {'12': {'max_depth': 50, 'min_new_ratio': 0.2, 'low_pages': 3, 'watermark': True}}
+# max_depth: 最大翻页深度(入口页深度为DEEP_LEVEL)  min_new_ratio/low_pages: 连续low_pages页新链接占比低于min_new_ratio时停止
+# watermark: 列表页最新数据时间(parse_list返回newest_time)不晚于上次采集的最新时间时停止
+PAGINATION_POLICIES = {}
+PAGINATION_WATERMARK_KEY = '%(name)s:list_watermark'  # 入口列表水位线hash
+LIST_CONDITIONAL_ENABLED = True  # 列表页带 ETag/Last-Modified 条件请求,未变化(304)时不解析不翻页
+LIST_VALIDATORS_KEY = '%(name)s:list_validators'  # 列表页校验信息hash
+LIST_DIGEST_ENABLED = False  # 列表页详情链接与上次相同时跳过判重与翻页(会跳过RECRAWL_WINDOW重采),需开启LIST_CONDITIONAL_ENABLED
+LIST_DIGESTS_KEY = '%(name)s:list_digests'  # 列表页详情链接摘要hash
+
+SCRIPT_PACKAGE = 'spider.script'  # 模板脚本所在包,脚本模块名为 s站点id_模板id
+SCRIPT_CHECK_INTERVAL = 5  # 检查模板脚本文件/版本号变化的间隔(秒)
+SCRIPT_VERSION_KEY = 'spider:template_version'  # 模板版本号hash,field为 站点id_模板id,修改后重新加载脚本
+SCRIPT_PRELOAD = []  # 启动时预加载的模板脚本,如 ['12_3', '12_4']
+PARSE_EXECUTOR = 'inline'  # 模板脚本默认解析方式: inline(reactor线程) / thread(线程池) / process(进程池)
+PARSE_EXECUTORS = {}  # 按模板id配置解析方式,如 {'3': 'process', '4': 'thread'}
+PARSE_THREAD_WORKERS = 4  # 解析线程池大小
+PARSE_PROCESS_WORKERS = 0  # 解析进程池大小,0为cpu核数
+DOWNLOAD_MAXSIZE = 10 * 1024 * 1024  # 响应大小上限(字节),超过后放弃下载,任务按请求失败确认
+DOWNLOAD_WARNSIZE = 2 * 1024 * 1024  # 响应超过该大小时记录警告
+DOWNLOAD_MAXSIZES = {}  # 按站点配置响应大小上限,如 {'12': 20971520, '12_3': 5242880}
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
-AUTOTHROTTLE_ENABLED = True  # 自动采集优化开启
+AUTOTHROTTLE_ENABLED = False  # 由SpiderThrottleMiddleware按域名控制并发
 # The initial download delay
 # AUTOTHROTTLE_START_DELAY = 5
 # The maximum download delay to be set in case of high latencies
@@ -4,24 +4,46 @@
 # @Author : shl
 # @File : main.py
 # @Desc :
-import importlib
-import json
+import os
+import socket
 
+from itemadapter import ItemAdapter
 from scrapy import Request, signals
-from scrapy_redis import defaults, connection
+from scrapy.exceptions import IgnoreRequest
+from scrapy_redis import defaults
 from scrapy_redis.spiders import RedisSpider
-from scrapy_redis.utils import bytes_to_str
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
+
+from spider.codec import TaskCodec
+from spider.connection import get_redis
+from spider.context import TaskContext
+from spider.default import LIST_TASK
+from spider.executor import INLINE, ParseExecutor
+from spider.feeder import TaskFeeder
+from spider.items import TaskItem
+from spider.loader import ScriptRegistry
+from spider.metrics import LatencyRecorder
+from spider.queue import FairQueue, ReliableQueue
 
 
 class Spider(RedisSpider):
     name = 'spider'
 
     def __init__(self, master=1):
-        self._task = {}
-        self._task_type = 0
-        self.html = ''
         self.is_master = master
         self.fetch_data = None
+        self.scripts = None
+        self.executor = None
+        self.codec = None
+        self.latency = None
+        self.queue = None
+        self.reliable = None
+        self.feeder = None
+        self.download_maxsizes = {}
+        self._version_task = None
+        self._ack_task = None
+        self._reap_task = None
         self._master()
 
     def _master(self):
@@ -74,9 +96,19 @@ class Spider(RedisSpider):
                          "(batch size: %(redis_batch_size)s, encoding: %(redis_encoding)s)",
                          self.__dict__)
 
-        self.server = connection.from_settings(crawler.settings)
+        self.server = get_redis(crawler)
+        self.scripts = ScriptRegistry.from_settings(settings, self.server)
+        self.executor = ParseExecutor.from_settings(settings, self.scripts)
+        self.codec = TaskCodec.from_settings(self.server, settings, self.name)
+        self.latency = LatencyRecorder.from_crawler(crawler)
+        self.download_maxsizes = {str(k): int(v) for k, v in settings.getdict('DOWNLOAD_MAXSIZES').items()}
 
-        if self.settings.getbool('REDIS_START_URLS_AS_SET', defaults.START_URLS_AS_SET):
+        if settings.getbool('REDIS_FAIR_QUEUE'):
+            self.queue = FairQueue(self.server, self.redis_key, settings.getdict('SITE_WEIGHTS'),
+                                   raw_weight=settings.getfloat('RAW_QUEUE_WEIGHT', 1.0))
+            self.fetch_data = self.pop_fair_queue
+            self.count_size = self.count_fair_queue
+        elif self.settings.getbool('REDIS_START_URLS_AS_SET', defaults.START_URLS_AS_SET):
             self.fetch_data = self.server.spop
             self.count_size = self.server.scard
         elif self.settings.getbool('REDIS_START_URLS_AS_ZSET', defaults.START_URLS_AS_ZSET):
@@ -86,26 +118,183 @@ class Spider(RedisSpider):
             self.fetch_data = self.pop_list_queue
             self.count_size = self.server.llen
 
+        if settings.getbool('RELIABLE_QUEUE'):
+            if self.fetch_data not in (self.pop_fair_queue, self.pop_list_queue):
+                raise ValueError("RELIABLE_QUEUE only supports list or fair queues")
+            worker_id = settings.get('WORKER_ID') or '{0}:{1}'.format(socket.gethostname(), os.getpid())
+            self.reliable = ReliableQueue(self.server, self.redis_key, worker_id,
+                                          settings.getint('RELIABLE_TIMEOUT', 600), self.queue,
+                                          max_deliveries=settings.getint('RELIABLE_MAX_DELIVERIES', 3),
+                                          dead_max=settings.getint('RELIABLE_DEAD_MAX', 10000))
+            self.fetch_data = self.pop_reliable_queue
+
         # The idle signal is called when the spider has no requests left,
         # that's when we will schedule new requests from redis queue
         crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
         crawler.signals.connect(self.engine_started, signal=signals.engine_started)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self.engine_stopped, signal=signals.engine_stopped)
+
+    def start_requests(self):
+        if self.settings.getbool('FEEDER_ENABLED'):
+            return []  # 由TaskFeeder持续补充任务
+        return super(Spider, self).start_requests()
+
+    def schedule_next_requests(self):
+        if self.feeder is not None:
+            self.feeder.feed()
+        else:
+            super(Spider, self).schedule_next_requests()
+
+    def fetch_tasks(self, redis_key, batch_size):
+        """
+        获取任务并加载缺少的任务头,在线程中调用
+        :param redis_key:
+        :param batch_size:
+        :return: 任务列表
+        """
+        datas = self.fetch_data(redis_key, batch_size)
+        payloads = datas if self.reliable is None else [ReliableQueue.payload(data) for data in datas]
+        try:
+            self.codec.load_headers(payloads)
+        except Exception as e:  # 任务已出队,不能因任务头加载失败丢弃,解码时再逐条获取
+            self.logger.error('任务头加载失败：{0}'.format(repr(e)))
+        return datas
+
+    def pop_fair_queue(self, redis_key, batch_size):
+        """
+        按站点公平批量获取任务
+        :param redis_key:
+        :param batch_size:
+        :return:
+        """
+        return self.queue.pop(batch_size)
+
+    def count_fair_queue(self, redis_key):
+        return self.queue.count()
+
+    def pop_reliable_queue(self, redis_key, batch_size):
+        """
+        获取任务并移入处理中队列,数据保存后确认
+        :param redis_key:
+        :param batch_size:
+        :return:
+        """
+        return self.reliable.pop(batch_size)
+
+    def release_tasks(self, datas):
+        """
+        已出队但未发出请求的任务放回任务队列队首(爬虫关闭时调用)
+        按站点拆分的非可靠模式下任务不带站点id,放回原始队列;有序集合队列中的任务以0分放回
+        :param datas: 任务列表(可靠模式下为处理中记录)
+        :return: int 放回数
+        """
+        if not datas:
+            return 0
+        if self.reliable is not None:
+            return self.reliable.release(datas)
+        if self.fetch_data == self.server.spop:
+            self.server.sadd(self.redis_key, *datas)
+        elif self.fetch_data == self.pop_priority_queue:
+            self.server.zadd(self.redis_key, {data: 0 for data in datas})
+        else:
+            self.server.lpush(self.redis_key, *reversed(datas))
+        return len(datas)
+
+    def ack_task(self, member):
+        """
+        确认任务已完成
+        :param member: 处理中记录,非可靠模式下为None
+        :return:
+        """
+        if self.reliable is not None and member:
+            self.reliable.ack(member)
+
+    def fail_task(self, member, reason):
+        """
+        任务无法解码、下载最终失败或下载后处理失败(模板解析或管道出错),移入死信队列,不再被反复回收
+        :param member: 处理中记录,非可靠模式下不处理
+        :param reason: decode / download / parse / pipeline
+        :return:
+        """
+        if self.reliable is not None and member:
+            self.crawler.stats.inc_value('reliable/dead/{0}'.format(reason))
+            self.reliable.dead(member)
+
+    def _flush_acks(self):
+        d = deferToThread(self.reliable.flush_acks)
+        d.addErrback(lambda f: self.logger.error('任务确认失败：{0}'.format(f.getErrorMessage())))
+        return d
+
+    def _reap_tasks(self):
+        d = deferToThread(self.reliable.reap, self.settings.getint('RELIABLE_REAP_BATCH', 100))
+        d.addCallbacks(self._reaped, lambda f: self.logger.error('超时任务回收失败：{0}'.format(f.getErrorMessage())))
+        return d
+
+    def _reaped(self, result):
+        requeued, dead = result
+        if requeued:
+            self.crawler.stats.inc_value('reliable/requeued', requeued)
+            self.logger.info('超时未确认任务已放回队列：{0}条'.format(requeued))
+        if dead:
+            self.crawler.stats.inc_value('reliable/dead/timeout', dead)
+            self.logger.warning('超时次数过多的任务已移入死信队列：{0}条'.format(dead))
 
     def engine_started(self):
         if self.is_master:
             self.logger.info("master spider being executed......")
         else:
             self.logger.info("slave spider being executed......")
+        self.scripts.refresh_versions()
+        self.scripts.preload(self.settings.getlist('SCRIPT_PRELOAD'))
+        if self.scripts.version_key:
+            self._version_task = LoopingCall(self._refresh_script_versions)
+            self._version_task.start(self.scripts.check_interval, now=False)
+        if self.settings.getbool('FEEDER_ENABLED'):
+            self.feeder = TaskFeeder.from_spider(self)
+            self.feeder.start()
+        if self.reliable is not None:
+            self._ack_task = LoopingCall(self._flush_acks)
+            self._ack_task.start(self.settings.getfloat('RELIABLE_ACK_INTERVAL', 1), now=False)
+            self._reap_task = LoopingCall(self._reap_tasks)
+            self._reap_task.start(self.settings.getfloat('RELIABLE_REAP_INTERVAL', 30))
+
+    def spider_closed(self):
+        """
+        爬虫关闭时已没有处理中的请求,提交剩余的任务确认,
+        需在 engine_stopped 之前完成,engine_stopped 时共用的redis连接池会被断开
+        :return:
+        """
+        for looping_task in (self._ack_task, self._reap_task):
+            if looping_task and looping_task.running:
+                looping_task.stop()
+        if self.reliable is not None:
+            return self._flush_acks()
+
+    def engine_stopped(self):
+        if self._version_task and self._version_task.running:
+            self._version_task.stop()
+        self.executor.close()
+
+    def _refresh_script_versions(self):
+        d = deferToThread(self.scripts.refresh_versions)
+        d.addErrback(lambda f: self.logger.error('模板版本号获取失败：{0}'.format(f.getErrorMessage())))
+        return d
 
     def make_request_from_data(self, data):
         """
         解析任务
-        :param data: str redis任务数据
+        :param data: str redis任务数据(可靠模式下为处理中记录)
         :return:
         """
-        data = bytes_to_str(data, self.redis_encoding)
-        _data = json.loads(data)
-        return self.make_requests_from_url(_data)
+        member = None
+        if self.reliable is not None:
+            member, data = data, ReliableQueue.payload(data)
+        _data = self.codec.decode(data)
+        request = self.make_requests_from_url(_data)
+        if member is not None:
+            request.meta['redis_member'] = member
+        return request
 
     def make_requests_from_url(self, _data):
         """
@@ -114,35 +303,71 @@ class Spider(RedisSpider):
         :return:
         """
         url = _data.get('url', '')
-        request = Request(url, meta={'task': _data}, dont_filter=True)
+        request = Request(url, meta={'task': _data}, dont_filter=True, errback=self.task_failed)
+        maxsize = self.get_download_maxsize(_data)
+        if maxsize is not None:
+            request.meta['download_maxsize'] = maxsize  # 超过该大小的响应在下载中途放弃
         return request
 
-    def parse(self, response, **kwargs):
-        print(response.text)
-        self._init_info(response)
-        data = self._do_task()
-        yield data
-
-    def _do_task(self):
-        script_class = self.load_script_class()
-        _class = script_class(self)
-        if self._task_type == 0:
-            data = self.parse_list(_class)
-        else:
-            data = self.parse_detail(_class)
-        return data
+    def get_download_maxsize(self, _data):
+        """
+        按站点配置的响应大小上限,优先取 站点id_模板id 的配置,其次站点id,未配置时使用 DOWNLOAD_MAXSIZE
+        :param _data: dict 任务信息
+        :return: int 字节数,未单独配置时为None
+        """
+        site_id = _data.get('site_id')
+        for key in ('{0}_{1}'.format(site_id, _data.get('template_id')), str(site_id)):
+            if key in self.download_maxsizes:
+                return self.download_maxsizes[key]
+        return None
 
-    def _init_info(self, req):
+    def task_failed(self, failure):
         """
-        初始任务数据信息
-        :param req:
+        请求最终失败(超时、代理失败或超过下载大小上限),任务移入死信队列,避免丢失也避免被反复回收
+        :param failure:
         :return:
         """
-        meta_info = req.meta
-        html_text = req.text
-        self._task = meta_info.get('task', {})
-        self._task_type = self._task.get('task_type', '')
-        self.html = html_text
+        request = getattr(failure, 'request', None)
+        if request is None:
+            return
+        if failure.check(IgnoreRequest):  # 关闭时被丢弃的请求(如等待代理),可靠模式下由超时回收放回队列
+            self.logger.info('任务请求被忽略[{0}]：{1}'.format(failure.getErrorMessage(), request.url))
+            return
+        self.fail_task(request.meta.get('redis_member'), 'download')
+        self.logger.warning('任务请求失败[{0}]：{1}'.format(failure.getErrorMessage(), request.url))
+
+    async def parse(self, response, **kwargs):
+        context = TaskContext.from_response(response, self)
+        if response.status == 304:  # 列表页未变化,不解析也不翻页
+            self.ack_task(context.member)
+            return []
+        try:
+            if self.executor.mode(context.template_id) == INLINE:
+                data = self._do_task(context)
+            else:
+                data, latency = await self.executor.submit(context)
+                stage = 'parse_list' if context.task_type == LIST_TASK else 'parse_detail'
+                self.latency.record(stage, latency, site_id=context.site_id, template_id=context.template_id)
+        except Exception as e:  # 模板脚本出错的任务重新采集也会出错,移入死信队列
+            self.logger.error('模板解析失败[{0}]：{1}'.format(response.url, repr(e)), exc_info=True)
+            self.fail_task(context.member, 'parse')
+            return []
+        context.detach()  # 解析完成,item在管道中不再持有响应正文
+        if data is not None:
+            return [TaskItem(ItemAdapter(data).asdict(), context)]
+        self.ack_task(context.member)
+        return []
+
+    def _do_task(self, context):
+        script_class = self.load_script_class(context)
+        _class = script_class(context)
+        if context.task_type == LIST_TASK:
+            with self.latency.timer('parse_list', site_id=context.site_id, template_id=context.template_id):
+                data = self.parse_list(_class)
+        else:
+            with self.latency.timer('parse_detail', site_id=context.site_id, template_id=context.template_id):
+                data = self.parse_detail(_class)
+        return data
 
     @staticmethod
     def parse_list(_class):
@@ -152,7 +377,6 @@ class Spider(RedisSpider):
         :return:
         """
         list_data = _class.parse_list()
-        print('解析列表信息')
         return list_data
 
     @staticmethod
@@ -162,31 +386,15 @@ class Spider(RedisSpider):
         :param _class: 动态加载的类
         :return:
         """
-        print('解析详情信息')
         detail_data = _class.parse_detail()
         return detail_data
 
-    @staticmethod
-    def load_script(site_id, template_id):
-        """
-        动态加载模板脚本
-        :param site_id:
-        :param template_id:
-        :return:
-        """
-        script_path = 'spider.script.s{0}_{1}'.format(site_id, template_id)
-        module_script = importlib.import_module('.', script_path)
-        importlib.reload(module_script)
-        return module_script
-
-    def load_script_class(self):
+    def load_script_class(self, context):
         """
         加载对应模板脚本的类
+        :param context: 任务上下文
         :return:
         """
-        class_name = 'Script'
-        site_id = self._task.get('site_id')  # 网站配置的站点id
-        template_id = self._task.get('template_id')  # 网站配置的站点采集数据类型id
-        module = self.load_script(site_id, template_id)
-        script_class = getattr(module, class_name)
-        return script_class
+        site_id = context.site_id  # 网站配置的站点id
+        template_id = context.template_id  # 网站配置的站点采集数据类型id
+        return self.scripts.get(site_id, template_id)
@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/18 21:40
+# @Author : shl
+# @File : throttle.py
+# @Desc : 按域名自适应并发控制,按 (域名, 代理) 判断封禁与过载
+import logging
+import time
+from collections import deque
+
+from scrapy_redis.utils import bytes_to_str
+from twisted.internet import defer
+from twisted.internet.threads import deferToThread
+
+logger = logging.getLogger(__name__)
+
+
+class ThrottleSlot:
+    """
+    单个 (域名, 代理) 的下载耗时,只用于判断封禁与过载,代理用完即弃,不承担并发窗口
+    """
+    __slots__ = ('latency', 'seen_at')
+
+    def __init__(self):
+        self.latency = None  # 下载耗时的指数加权平均(秒)
+        self.seen_at = time.time()
+
+
+class DomainState:
+    """
+    域名的并发窗口,限制该域名经所有代理发出的请求总数,窗口大小通过redis在所有爬虫进程间共享
+    """
+    __slots__ = ('limit', 'active', 'waiters', 'baseline', 'decreased_at', 'changed')
+
+    def __init__(self, limit):
+        self.limit = limit  # 允许的并发数(AIMD调整,可为小数)
+        self.active = 0
+        self.waiters = deque()
+        self.baseline = None  # 正常情况下的下载耗时(秒)
+        self.decreased_at = 0.0
+        self.changed = False  # 上次同步后本进程是否调整过
+
+    def available(self):
+        return self.active < max(int(self.limit), 1)
+
+
+class AdaptiveThrottle:
+    """
+    AIMD并发控制: 并发窗口按域名计算,换代理不会绕开窗口,
+    请求正常且耗时未超过基准耗时的 latency_factor 倍时并发数加性增长(每轮约加increase),
+    被封禁(403/429/验证码页)、请求异常或耗时过高时乘性减少,同一轮内多次失败只减少一次,
+    一轮的长度取发生失败的 (域名, 代理) 的平均下载耗时
+    """
+
+    def __init__(self, start=4, minimum=1, maximum=32, increase=1.0, decrease=0.5, latency_factor=3.0,
+                 ewma_alpha=0.3, idle_timeout=300):
+        self.start = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.ewma_alpha = ewma_alpha
+        self.idle_timeout = idle_timeout  # 空闲超过该时间(秒)的 (域名, 代理) 状态被清理
+        self.slots = {}
+        self.domains = {}
+
+    def domain(self, domain):
+        state = self.domains.get(domain)
+        if state is None:
+            state = self.domains[domain] = DomainState(self.start)
+        return state
+
+    def slot(self, key):
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = ThrottleSlot()
+        slot.seen_at = time.time()
+        return slot
+
+    def acquire(self, key):
+        """
+        占用域名的一个并发,已达并发上限时等待
+        :param key: (域名, 代理)
+        :return: Deferred
+        """
+        self.slot(key)
+        domain = self.domain(key[0])
+        if domain.available() and not domain.waiters:
+            domain.active += 1
+            return defer.succeed(None)
+        d = defer.Deferred()
+        domain.waiters.append(d)
+        return d
+
+    def release(self, key):
+        domain = self.domains.get(key[0])
+        if domain is None:
+            return
+        domain.active -= 1
+        self.wake(domain)
+
+    @staticmethod
+    def wake(domain):
+        while domain.waiters and domain.available():
+            domain.active += 1
+            domain.waiters.popleft().callback(None)
+
+    def report_success(self, key, latency=None):
+        """
+        请求正常,耗时未超过基准时增加并发数
+        :param key:
+        :param latency: 下载耗时(秒)
+        :return:
+        """
+        slot = self.slot(key)
+        domain = self.domain(key[0])
+        if latency is not None:
+            slot.latency = latency if slot.latency is None else slot.latency + self.ewma_alpha * (latency - slot.latency)
+            if domain.baseline is None or latency < domain.baseline:
+                domain.baseline = latency
+            else:
+                domain.baseline += 0.01 * (latency - domain.baseline)  # 基准耗时缓慢跟随网络变化
+            if latency > domain.baseline * self.latency_factor and domain.baseline > 0:
+                self.report_failure(key)
+                return
+        domain.limit = min(domain.limit + self.increase / max(domain.limit, 1), self.maximum)
+        domain.changed = True
+        self.wake(domain)
+
+    def report_failure(self, key):
+        """
+        封禁、异常或耗时过高,减少并发数
+        :param key:
+        :return: bool 是否减少了并发数
+        """
+        slot = self.slot(key)
+        domain = self.domain(key[0])
+        now = time.time()
+        if now - domain.decreased_at < (slot.latency or 1.0):  # 同一轮内的失败只减少一次
+            return False
+        domain.decreased_at = now
+        domain.limit = max(domain.limit * self.decrease, self.minimum)
+        domain.changed = True
+        return True
+
+    def prune(self):
+        """
+        清理长时间空闲的 (域名, 代理),代理用完即弃,不清理会一直增长
+        :return: int 清理数
+        """
+        deadline = time.time() - self.idle_timeout
+        idle = [key for key, slot in self.slots.items() if slot.seen_at < deadline]
+        for key in idle:
+            del self.slots[key]
+        return len(idle)
+
+
+class ThrottleSync:
+    """
+    域名并发数通过redis hash在爬虫进程间共享: 本进程调整过的写入,未调整过的采用其他进程学习到的值
+    """
+
+    def __init__(self, server, key, throttle):
+        self.server = server
+        self.key = key  # field为域名
+        self.throttle = throttle
+        self._syncing = False
+
+    def sync(self):
+        if self._syncing or not self.throttle.domains:
+            return defer.succeed(None)
+        self._syncing = True
+        changed = {}
+        for domain, state in self.throttle.domains.items():
+            if state.changed:
+                changed[domain] = round(state.limit, 3)
+                state.changed = False
+        domains = list(self.throttle.domains)
+        d = deferToThread(self._exchange, changed, domains)
+        d.addCallbacks(self._synced, self._sync_failed, callbackArgs=(domains,))
+        return d
+
+    def _exchange(self, changed, domains):
+        with self.server.pipeline(transaction=False) as pipe:
+            if changed:
+                pipe.hset(self.key, mapping=changed)
+            pipe.hmget(self.key, domains)
+            return pipe.execute()[-1]
+
+    def _synced(self, values, domains):
+        self._syncing = False
+        for domain, value in zip(domains, values):
+            state = self.throttle.domains.get(domain)
+            if value is None or state is None or state.changed:
+                continue
+            state.limit = min(max(float(bytes_to_str(value)), self.throttle.minimum), self.throttle.maximum)
+            self.throttle.wake(state)  # 其他进程学习到的并发数更大时唤醒等待中的请求
+        self.throttle.prune()
+
+    def _sync_failed(self, failure):
+        self._syncing = False
+        logger.error('并发数同步失败：{0}'.format(failure.getErrorMessage()))
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @Time : 2026/10/19 10:20
+# @Author : shl
+# @File : test_pipelines.py
+# @Desc : 详情数据内容指纹
+import hashlib
+
+import pytest
+
+pipelines = pytest.importorskip('spider.pipelines')
+
+
+class DictPipeline:
+    def __init__(self, data):
+        self.data = data
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def hget(self, key, field):
+        self.results.append(self.data.get(key, {}).get(field))
+
+    def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+        self.results.append(len(mapping))
+
+    def expire(self, key, seconds):
+        self.results.append(True)
+
+    def execute(self):
+        results, self.results = self.results, []
+        return results
+
+
+class DictRedis:
+    """
+    只实现内容指纹用到的hash命令
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return DictPipeline(self.data)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(pipelines.time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def store():
+    return pipelines.ContentFingerprintStore(DictRedis(), ttl=100, shards=4)
+
+
+def entry(url, content):
+    _id = hashlib.md5(url.encode('utf-8')).hexdigest()
+    return None, _id, pipelines.SpiderMongoPipeline.content_fingerprint({'content': content})
+
+
+def test_unchanged_in_current_generation(store, clock):
+    a = entry('http://a', 'A')
+    assert store.changed('spider', 'news', [a]) == ([a], [])
+    store.save('spider', 'news', [a])
+    assert store.changed('spider', 'news', [a]) == ([], [])
+
+
+def test_unchanged_in_previous_generation_is_carried(store, clock):
+    a = entry('http://a', 'A')
+    store.save('spider', 'news', [a])
+    clock[0] += 100
+    assert store.changed('spider', 'news', [a]) == ([], [a])
+    store.save('spider', 'news', [a])
+    assert store.changed('spider', 'news', [a]) == ([], [])
+
+
+def test_current_generation_wins_over_previous(store, clock):
+    a, b = entry('http://a', 'A'), entry('http://a', 'B')
+    store.save('spider', 'news', [a])  # 上一代为A
+    clock[0] += 100
+    store.save('spider', 'news', [b])  # 当前代变为B,内容改回A时mongo中仍是B,需要写入
+    assert store.changed('spider', 'news', [a]) == ([a], [])
+
+
+def test_expired_generation_is_changed(store, clock):
+    a = entry('http://a', 'A')
+    store.save('spider', 'news', [a])
+    clock[0] += 200
+    assert store.changed('spider', 'news', [a]) == ([a], [])